@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+### -*- coding: utf-8 -*- ####################################################
+"""
+Compare subscription.utils.extend_dates_by() with a loop over scalar
+extend_date_by().
+
+Run from a project directory, e.g.:
+
+    DJANGO_SETTINGS_MODULE=settings python benchmarks/extend_dates.py 1000000
+"""
+
+import datetime
+import random
+import sys
+import time
+
+from subscription import utils
+
+def timed(label, func, *args):
+    start = time.time()
+    rv = func(*args)
+    print '%-32s %8.3f s' % (label, time.time() - start)
+    return rv
+
+def main(count=1000000):
+    random.seed(0)
+    start = datetime.date(2000, 1, 1)
+    dates = [start + datetime.timedelta(random.randrange(10000)) for i in xrange(count)]
+    amounts = [random.randrange(1, 13) for i in xrange(count)]
+    units = [random.choice('DWMY') for i in xrange(count)]
+    print '%d dates, NumPy %s' % (count, utils.numpy is None and 'not available' or utils.numpy.__version__)
+
+    scalar = timed('extend_date_by (loop)', lambda: map(utils.extend_date_by, dates, amounts, units))
+    python = timed('extend_dates_by (pure Python)', utils._extend_dates_by_python, dates, amounts, units)
+    vector = timed('extend_dates_by', utils.extend_dates_by, dates, amounts, units)
+    assert scalar == python == vector
+
+    if utils.numpy is not None:
+        numpy = utils.numpy
+        arrays = (numpy.array(dates, dtype='datetime64[D]'), numpy.array(amounts), numpy.array(units))
+        timed('extend_dates_by (datetime64 in/out)', utils.extend_dates_by, *arrays)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+### -*- coding: utf-8 -*- ####################################################
+"""
+Latency and query counts of subscription hot paths, measured on a
+throw-away SQLite test database filled with generated data:
+
+    permissions   UserSubscriptionBackend.get_all_permissions()
+    payment       handle_payment_was_successful() for a new IPN
+    plans         {% paypal_shortcut %} rendered for every plan
+    invoices      first page of invoices.history()
+    invoice_pdf   invoices.invoice_file() rendering (needs ho.pisa)
+
+Results are written as JSON.  With --thresholds, a JSON file mapping
+benchmark names to limits of result fields, e.g.
+
+    {"payment": {"queries": 8, "p95_ms": 50}}
+
+is checked, failures are listed in the results and exit status is 1.
+Invoice pre-generation in worker processes is disabled.
+
+Run from a project directory whose database is SQLite, e.g.:
+
+    DJANGO_SETTINGS_MODULE=settings python benchmarks/hotpaths.py \\
+        --thresholds benchmarks/hotpaths.json --output results.json
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import django
+from django.db import connection, reset_queries
+
+def summary(timings, queries):
+    timings = sorted(timings)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {'count': len(timings),
+            'mean_ms': ms(sum(timings) / len(timings)),
+            'median_ms': ms(timings[len(timings) // 2]),
+            'p95_ms': ms(timings[min(len(timings) - 1, int(len(timings) * .95))]),
+            'max_ms': ms(timings[-1]),
+            'queries': max(queries)}
+
+def measure(func, calls):
+    """Call `func' with every argument tuple yielded by `calls';
+    arguments are prepared outside of measured time, and the first
+    call only warms up caches."""
+    timings, queries = [], []
+    calls = iter(calls)
+    func(*next(calls))
+    for args in calls:
+        reset_queries()
+        start = time.time()
+        func(*args)
+        timings.append(time.time() - start)
+        queries.append(len(connection.queries))
+    return summary(timings, queries)
+
+
+def generate(users, plans, payments):
+    """Create `plans' plans with permissions, `users' subscribed users
+    and `payments' payment transactions of the first user."""
+    from django.contrib.auth.models import Permission, User
+    from subscription.models import Subscription, Transaction
+
+    permissions = list(Permission.objects.all()[:plans * 3])
+    for i in range(plans):
+        plan = Subscription.objects.create(name='Plan %d' % i, price=5 * (i + 1),
+                                           recurrence_period=1, recurrence_unit='M')
+        plan.permissions.add(*permissions[:3 * (i + 1)])
+    User.objects.bulk_create([ User(username='user%d' % i) for i in xrange(users) ])
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    plan_list = list(Subscription.objects.all())
+    for i, plan in enumerate(plan_list):
+        plan.bulk_subscribe(user_ids[i::len(plan_list)])
+    Transaction.objects.bulk_create([
+            Transaction(user_id=user_ids[0], subscription=plan_list[0],
+                        event=Transaction.EVENT_PAYMENT, amount=plan_list[0].price)
+            for i in xrange(payments) ])
+    return user_ids, plan_list
+
+
+def bench_permissions(user_ids, plans, repeat):
+    from django.contrib.auth.models import User
+    from subscription.backends import UserSubscriptionBackend
+    backend = UserSubscriptionBackend()
+    return measure(backend.get_all_permissions,
+                   ((User.objects.get(id=user_ids[i % len(user_ids)]),)
+                    for i in xrange(repeat)))
+
+def bench_payment(user_ids, plans, repeat):
+    from paypal.standard.ipn.models import PayPalIPN
+    from subscription.paypalhandlers import handle_payment_was_successful
+    return measure(handle_payment_was_successful,
+                   ((PayPalIPN.objects.create(txn_id='BENCH%014d' % i,
+                                              custom=str(user_ids[i % len(user_ids)]),
+                                              mc_gross='5.00', ipaddress='127.0.0.1'),)
+                    for i in xrange(repeat)))
+
+def bench_plans(user_ids, plans, repeat):
+    from django.contrib.auth.models import User
+    from django.template import Context, Template
+    template = Template('{% load paypal_buttons %}'
+                        '{% for plan in plans %}{% paypal_shortcut user plan %}{% endfor %}')
+    return measure(lambda context: template.render(context),
+                   ((Context({'user': User.objects.get(id=user_ids[i % len(user_ids)]),
+                              'plans': plans}),)
+                    for i in xrange(repeat)))
+
+def bench_invoices(user_ids, plans, repeat):
+    from django.contrib.auth.models import User
+    from subscription import invoices
+    user = User.objects.get(id=user_ids[0])
+    return measure(invoices.history, ((user,) for i in xrange(repeat)))
+
+def bench_invoice_pdf(user_ids, plans, repeat):
+    try:
+        import ho.pisa
+    except ImportError:
+        return {'skipped': 'ho.pisa is not installed'}
+    from django.test.utils import override_settings
+    from subscription import invoices
+    from subscription.models import Transaction
+    import subscription
+    cache_dir = tempfile.mkdtemp()
+    ids = list(Transaction.objects.filter(event=Transaction.EVENT_PAYMENT, user=user_ids[0])
+               .values_list('id', flat=True)[:repeat])
+    try:
+        with override_settings(
+                TEMPLATE_DIRS=(os.path.join(os.path.dirname(subscription.__file__),
+                                            'tests', 'templates'),),
+                SUBSCRIPTION_INVOICE_TEMPLATE='subscription/test_invoice.html',
+                SUBSCRIPTION_INVOICE_CACHE_DIR=cache_dir,
+                SUBSCRIPTION_INVOICE_WORKERS=0):
+            return measure(invoices.invoice_file, ((pk,) for pk in ids))
+    finally:
+        shutil.rmtree(cache_dir)
+
+BENCHMARKS = (
+    ('permissions', bench_permissions),
+    ('payment', bench_payment),
+    ('plans', bench_plans),
+    ('invoices', bench_invoices),
+    ('invoice_pdf', bench_invoice_pdf),
+)
+
+
+def check(results, thresholds):
+    """Return list of messages for result fields above their limits."""
+    failures = []
+    for name, limits in sorted(thresholds.items()):
+        result = results.get(name, {})
+        for field, limit in sorted(limits.items()):
+            if field in result and result[field] > limit:
+                failures.append('%s: %s %s > %s' % (name, field, result[field], limit))
+    return failures
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--users', type='int', default=1000,
+                      help='number of subscribed users to generate')
+    parser.add_option('--plans', type='int', default=10,
+                      help='number of plans to generate')
+    parser.add_option('--payments', type='int', default=200,
+                      help='number of payments in invoice history')
+    parser.add_option('--repeat', type='int', default=200,
+                      help='number of calls per benchmark (first one is not measured)')
+    parser.add_option('--only', action='append', default=[],
+                      help='run only this benchmark (may be repeated)')
+    parser.add_option('--thresholds', help='JSON file with limits to check')
+    parser.add_option('--output', help='write JSON results to this file instead of stdout')
+    options, args = parser.parse_args()
+
+    if connection.settings_dict['ENGINE'] != 'django.db.backends.sqlite3':
+        parser.error('benchmarks must run on SQLite database')
+    from django.core.cache import cache
+
+    from django.test.utils import override_settings
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    connection.use_debug_cursor = True
+    workers = override_settings(SUBSCRIPTION_INVOICE_WORKERS=0)
+    workers.enable()
+    try:
+        user_ids, plans = generate(options.users, options.plans, options.payments)
+        results = {}
+        for name, bench in BENCHMARKS:
+            if options.only and name not in options.only:
+                continue
+            cache.clear()
+            results[name] = bench(user_ids, plans, options.repeat)
+    finally:
+        workers.disable()
+        connection.use_debug_cursor = None
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {'python': sys.version.split()[0], 'django': django.get_version(),
+              'users': options.users, 'plans': options.plans,
+              'payments': options.payments, 'results': results}
+    if options.thresholds:
+        with open(options.thresholds) as f:
+            report['failures'] = check(results, json.load(f))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+    for failure in report.get('failures', ()):
+        print >>sys.stderr, 'FAILED', failure
+    return report.get('failures') and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,8 @@
 ### -*- coding: utf-8 -*- ##
 
 import paypalhandlers
-import transactionhandlers
\ No newline at end of file
+import transactionhandlers
+import invoices
+import rollups
+import scheduler
+import usercache
@@ -2,36 +2,108 @@
 from datetime import datetime
 
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse, NoReverseMatch
 from django.forms.models import BaseInlineFormSet
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.utils.html import conditional_escape as esc
 from django.contrib.auth.admin import UserAdmin, User
-from django.db import models
+from django.contrib.auth.models import Permission
+from django.db import connections, models
 
 from saaskit.widgets.readonlyhidden import ReadOnlyWidgetWithHidden
-from subscription.models import Subscription, UserSubscription, Transaction
+from subscription import ipnqueue
+from subscription.models import Subscription, UserSubscription, Transaction, \
+     ArchivedTransaction, DailyRollup, QueuedIPN
 
 def _pricing(sub): return sub.get_pricing_display()
 def _trial(sub): return sub.get_trial_display()
 
 def _subscription(trans):
+    if trans.subscription_id is None:
+        return u''
     return u'<a href="/admin/subscription/subscription/%d/">%s</a>' % (
-        trans.subscription.pk, esc(trans.subscription) )
+        trans.subscription_id, esc(trans.subscription) )
 _subscription.allow_tags = True
 
 def _user(trans):
+    if trans.user_id is None:
+        return u''
     return u'<a href="/admin/auth/user/%d/">%s</a>' % (
-        trans.user.pk, esc(trans.user) )
+        trans.user_id, esc(trans.user) )
 _user.allow_tags = True
 
 def _ipn(trans):
+    if trans.ipn_id is None:
+        return u''
     return u'<a href="/admin/ipn/paypalipn/%d/">#%s</a>' % (
-        trans.ipn.pk, trans.ipn.pk )
+        trans.ipn_id, trans.ipn_id )
 _ipn.allow_tags = True
 
 def event(trans): return trans.get_event_display()
 def timestamp(trans): return trans.timestamp
 
+ESTIMATE_SQL = {
+    'postgresql': "SELECT reltuples FROM pg_class WHERE relname = %s",
+    'mysql': ("SELECT table_rows FROM information_schema.tables "
+              "WHERE table_schema = DATABASE() AND table_name = %s"),
+    }
+
+def estimated_count(queryset):
+    """Return number of rows in `queryset'.  If it is not filtered and
+    database statistics (PostgreSQL and MySQL only) show more than
+    SUBSCRIPTION_ADMIN_ESTIMATE_THRESHOLD rows (default 10000), the
+    estimate is returned instead of exact count."""
+    connection = connections[queryset.db]
+    sql = ESTIMATE_SQL.get(connection.vendor)
+    if sql and not queryset.query.where:
+        cursor = connection.cursor()
+        cursor.execute(sql, [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+        if row and row[0] is not None and \
+                row[0] > getattr(settings, 'SUBSCRIPTION_ADMIN_ESTIMATE_THRESHOLD', 10000):
+            return int(row[0])
+    return queryset.count()
+
+class EstimatedCountPaginator(Paginator):
+    def _get_count(self):
+        if self._count is None:
+            self._count = estimated_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+class EstimatedCountChangeList(ChangeList):
+    """Change list that estimates total (unfiltered) number of objects."""
+    def get_results(self, request):
+        root_query_set = self.root_query_set
+        class EstimatedRoot(object):
+            def count(self):
+                return estimated_count(root_query_set)
+        self.root_query_set = EstimatedRoot()
+        try:
+            super(EstimatedCountChangeList, self).get_results(request)
+        finally:
+            self.root_query_set = root_query_set
+
+class EstimatedCountAdmin(admin.ModelAdmin):
+    """Admin for large tables: object counts are estimated, and
+    `changelist_select_related' names related objects to join for list
+    display."""
+    paginator = EstimatedCountPaginator
+    changelist_select_related = ()
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    def queryset(self, request):
+        queryset = super(EstimatedCountAdmin, self).queryset(request)
+        if self.changelist_select_related:
+            queryset = queryset.select_related(*self.changelist_select_related)
+        return queryset
+
 class InlineBase(admin.TabularInline):
     extra = 0
     
@@ -40,35 +112,148 @@ class InlineBase(admin.TabularInline):
         return super(InlineBase, self).get_formset(request, obj=obj, **kwargs)
     
     
-class TransactionInline(InlineBase):
+class RecentInlineFormSet(BaseInlineFormSet):
+    """Inline formset of `max_recent' first objects in `recent_ordering'.
+
+    Bound formset uses objects that were posted back, even if newer ones
+    were added meanwhile."""
+    max_recent = 10
+    recent_ordering = ('-pk',)
+    total_count = None
+    more_url = None
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            queryset = super(RecentInlineFormSet, self).get_queryset()
+            if self.is_bound:
+                pk_name = self.model._meta.pk.name
+                pks = [ self.data.get('%s-%s' % (self.add_prefix(i), pk_name))
+                        for i in range(self.initial_form_count()) ]
+                queryset = queryset.filter(pk__in=[ pk for pk in pks if pk ])
+            else:
+                queryset = queryset.order_by(*self.recent_ordering)[:self.max_recent]
+            self._queryset = queryset
+        return self._queryset
+
+class RecentInline(InlineBase):
+    """
+        Inline showing only `max_recent' objects first in
+        `recent_ordering', with number of all related objects (cached for
+        SUBSCRIPTION_ADMIN_COUNT_TIMEOUT seconds, default 300) and a link
+        to their change list.
+    """
+    formset = RecentInlineFormSet
+    template = 'admin/subscription/recent_tabular.html'
+    max_recent = 10
+    recent_ordering = ('-pk',)
+    inline_select_related = ()
+
+    def queryset(self, request):
+        queryset = super(RecentInline, self).queryset(request)
+        if self.inline_select_related:
+            queryset = queryset.select_related(*self.inline_select_related)
+        return queryset
+
+    def total_count(self, fk, obj):
+        key = 'subscription-admin-count:%s.%s:%s:%s' % (
+            self.opts.app_label, self.opts.module_name, fk.name, obj.pk)
+        count = cache.get(key)
+        if count is None:
+            count = self.model._default_manager.filter(**{fk.name: obj}).count()
+            cache.set(key, count, getattr(settings, 'SUBSCRIPTION_ADMIN_COUNT_TIMEOUT', 300))
+        return count
+
+    def get_formset(self, request, obj=None, **kwargs):
+        FormSet = super(RecentInline, self).get_formset(request, obj=obj, **kwargs)
+        FormSet.max_recent = self.max_recent
+        FormSet.recent_ordering = self.recent_ordering
+        if obj is not None and obj.pk is not None:
+            FormSet.total_count = self.total_count(FormSet.fk, obj)
+            try:
+                FormSet.more_url = '%s?%s__id__exact=%s' % (
+                    reverse('%s:%s_%s_changelist' % (self.admin_site.name, self.opts.app_label,
+                                                     self.opts.module_name)),
+                    FormSet.fk.name, obj.pk)
+            except NoReverseMatch:
+                pass
+        return FormSet
+
+
+class TransactionInline(RecentInline):
     model = Transaction
+    max_num = 0
+    recent_ordering = ('-id',)
+    inline_select_related = ('user', 'subscription')
+    fields = ('timestamp', 'event', 'subscription', 'user', _ipn, 'amount', 'comment')
+    readonly_fields = ('timestamp', 'event', 'subscription', 'user', _ipn, 'amount')
     
-class UserSubscriptionInline(InlineBase):
+class UserSubscriptionInline(RecentInline):
     model = UserSubscription
+    inline_select_related = ('user', 'subscription')
+    raw_id_fields = ('user',)
     
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('name', _pricing, _trial)
     filter_horizontal = ('permissions',)
     inlines = (UserSubscriptionInline, TransactionInline)
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if db_field.name == 'permissions':
+            kwargs['queryset'] = Permission.objects.select_related('content_type')
+        return super(SubscriptionAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
 admin.site.register(Subscription, SubscriptionAdmin)
 
 
-class UserSubscriptionAdmin(admin.ModelAdmin):
+class UserSubscriptionAdmin(EstimatedCountAdmin):
     list_display = ( '__unicode__', _user, _subscription, 'active', 'expires')
     list_display_links = ( '__unicode__', )
     list_filter = ('active', 'subscription', 'expires')
+    changelist_select_related = ('user', 'subscription')
+    search_fields = ('user__username', 'user__email')
+    raw_id_fields = ('user',)
     date_hierarchy = 'expires'
     ordering = ('-expires',)
 
 admin.site.register(UserSubscription, UserSubscriptionAdmin)
 
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(EstimatedCountAdmin):
     date_hierarchy = 'timestamp'
     list_display = ('timestamp', 'id', 'event', _subscription, _user, _ipn, 'amount', 'comment')
     list_display_links = ('timestamp', 'id')
-    list_filter = ('subscription', 'user')
+    list_filter = ('event', 'subscription')
+    changelist_select_related = ('user', 'subscription')
+    search_fields = ('user__username', 'user__email', 'ipn__txn_id')
+    raw_id_fields = ('user', 'ipn')
 admin.site.register(Transaction, TransactionAdmin)
 
+class ArchivedTransactionAdmin(TransactionAdmin):
+    pass
+admin.site.register(ArchivedTransaction, ArchivedTransactionAdmin)
+
+class DailyRollupAdmin(admin.ModelAdmin):
+    date_hierarchy = 'date'
+    list_display = ('date', 'subscription', 'event', 'count', 'amount')
+    list_filter = ('event', 'subscription')
+admin.site.register(DailyRollup, DailyRollupAdmin)
+
+def _error(queued):
+    lines = queued.last_error.strip().splitlines()
+    return lines and lines[-1] or u''
+_error.short_description = 'last error'
+
+def requeue(modeladmin, request, queryset):
+    count = ipnqueue.requeue(queryset)
+    modeladmin.message_user(request, '%d IPN(s) queued again.' % count)
+requeue.short_description = 'Queue selected IPNs again'
+
+class QueuedIPNAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created', 'handler', 'user_id', _ipn, 'attempts', 'next_attempt',
+                    'dead', _error)
+    list_filter = ('dead', 'handler')
+    raw_id_fields = ('ipn',)
+    actions = (requeue,)
+admin.site.register(QueuedIPN, QueuedIPNAdmin)
+
 class UserAdminSubscription(UserAdmin):
     inlines = (UserSubscriptionInline, TransactionInline)
  
@@ -1,8 +1,96 @@
 ### -*- coding: utf-8 -*- ##
 
+import threading
+import time
+
 from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from subscription.journal import journal
+from subscription.models import Subscription
+from subscription.usercache import user_subscriptions
+
+VERSION_KEY = 'subscription-permissions-version'
+
+class PlanPermissionCache(object):
+    """
+        Process-wide cache of "app_label.codename" permission sets keyed
+        by Subscription id.
+
+        Sets are frozen, so they may be shared between users.  They are
+        dropped whenever plan permissions change, a plan is saved or
+        deleted, or a permission is saved or deleted: then version kept
+        in Django cache under VERSION_KEY is changed, and every process
+        drops its sets on its next lookup.  Inside a journal unit of work
+        version is changed again once it is over (see
+        journal.after_commit()).
+    """
+    def __init__(self):
+        self._sets = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.shared_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subscription_id):
+        shared_version = cache.get(VERSION_KEY)
+        if shared_version is None:
+            shared_version = self._set_shared_version()
+        with self._lock:
+            if shared_version != self.shared_version:
+                self.shared_version = shared_version
+                self.version += 1
+                self._sets.clear()
+            perms = self._sets.get(subscription_id)
+            if perms is not None:
+                self.hits += 1
+                return perms
+            self.misses += 1
+            version = self.version
+
+        perms = frozenset([u"%s.%s" % (app_label, codename) for app_label, codename in
+                           Permission.objects.filter(subscription__id=subscription_id)
+                                             .values_list('content_type__app_label', 'codename')])
+        with self._lock:
+            # not kept if invalidated while loading
+            if version == self.version:
+                self._sets[subscription_id] = perms
+        return perms
+
+    def invalidate(self):
+        """Drop cached sets in all processes."""
+        with self._lock:
+            self.version += 1
+            self._sets.clear()
+        self._set_shared_version()
+        journal.after_commit(self._set_shared_version)
+
+    def _set_shared_version(self):
+        version = int(time.time() * 1000)
+        cache.set(VERSION_KEY, version, 30 * 24 * 3600)   # memcached maximum
+        return version
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._sets)}
+
+plan_permissions = PlanPermissionCache()
+
+
+def _permissions_changed(action, **kwargs):
+    if action.startswith('post_'):
+        plan_permissions.invalidate()
+m2m_changed.connect(_permissions_changed, sender=Subscription.permissions.through)
+
+def _changed(**kwargs):
+    plan_permissions.invalidate()
+post_save.connect(_changed, sender=Subscription)
+post_delete.connect(_changed, sender=Subscription)
+post_save.connect(_changed, sender=Permission)
+post_delete.connect(_changed, sender=Permission)
 
-from subscription.models import UserSubscription
 
 class UserSubscriptionBackend(ModelBackend):
     """
@@ -10,12 +98,8 @@ class UserSubscriptionBackend(ModelBackend):
     """
     def get_all_permissions(self, user_obj):
         perm_cache = super(UserSubscriptionBackend, self).get_all_permissions(user_obj)
-        try:
-            us = user_obj.subscription
-        except UserSubscription.DoesNotExist:
-            pass
-        else:
-            perm_cache.update(set([u"%s.%s" % (p.content_type.app_label, p.codename) 
-                                   for p in us.subscription.permissions.select_related()]))
-        
+        us = user_subscriptions.get(user_obj)
+        if us is not None:
+            perm_cache.update(plan_permissions.get(us.subscription_id))
+
         return perm_cache
@@ -0,0 +1,107 @@
+### -*- coding: utf-8 -*- ####################################################
+""" in-process cache of available subscriptions """
+
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import translation
+from django.utils.encoding import force_unicode
+
+from subscription.models import Subscription
+from subscription.usercache import user_subscriptions
+
+DISPLAY_METHODS = {
+    'pricing': 'get_pricing_display',
+    'trial': 'get_trial_display',
+    'recurrence': 'get_recurrence_display',
+    }
+
+class PlanCatalog(object):
+    """
+        Versioned, process-wide list of Subscription objects.
+
+        Each plan carries display strings pre-rendered for every language
+        it was requested in (and SUBSCRIPTION_CATALOG_LANGUAGES on load),
+        which Subscription.get_*_display() methods return without
+        formatting.  Cache is dropped on every Subscription save or
+        delete, and in other processes when they see plan version kept
+        in Django cache by subscription.usercache change.  Plans are
+        shared between requests and must not be modified.
+    """
+    def __init__(self):
+        self.version = 0
+        self.shared_version = None
+        self._plans = None
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        """Return catalog version, first dropping plans if plan version
+        in Django cache changed since last call."""
+        shared_version = user_subscriptions.plans_version()
+        with self._lock:
+            if shared_version != self.shared_version:
+                self.shared_version = shared_version
+                self.version += 1
+                self._plans = None
+            return self.version
+
+    def plans(self):
+        """Return list of all plans, with display strings rendered for
+        active language."""
+        self.current_version()
+        plans = self._plans
+        if plans is None:
+            plans = self._load()
+        language = translation.get_language()
+        for plan in plans:
+            if language not in plan._display_cache:
+                self._render(plan, language)
+        return plans
+
+    def get(self, subscription_id):
+        """Return plan with id `subscription_id', or None."""
+        for plan in self.plans():
+            if plan.id == subscription_id:
+                return plan
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._plans = None
+
+    def warm(self):
+        """Load catalog, ignoring database errors (e.g. tables not yet
+        created)."""
+        try:
+            self.plans()
+        except DatabaseError:
+            transaction.rollback_unless_managed()
+
+    def _load(self):
+        version = self.version
+        plans = list(Subscription.objects.all())
+        languages = getattr(settings, 'SUBSCRIPTION_CATALOG_LANGUAGES', (settings.LANGUAGE_CODE,))
+        for plan in plans:
+            plan._display_cache = {}
+            for language in languages:
+                self._render(plan, language)
+        with self._lock:
+            if version == self.version:
+                self._plans = plans
+        return plans
+
+    def _render(self, plan, language):
+        with translation.override(language):
+            plan._display_cache[language] = dict(
+                [(name, force_unicode(getattr(plan, method)()))
+                 for name, method in DISPLAY_METHODS.items()])
+
+catalog = PlanCatalog()
+
+
+def _subscription_changed(**kwargs):
+    catalog.invalidate()
+post_save.connect(_subscription_changed, sender=Subscription)
+post_delete.connect(_subscription_changed, sender=Subscription)
@@ -0,0 +1,112 @@
+### -*- coding: utf-8 -*- ####################################################
+""" signed entitlement tokens, verifiable without database access """
+
+import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponseForbidden
+
+from subscription.backends import plan_permissions
+from subscription.models import SUBSCRIPTION_GRACE_PERIOD
+
+SALT = 'subscription.entitlements'
+
+def _setting(name, default):
+    return getattr(settings, 'SUBSCRIPTION_ENTITLEMENT_' + name, default)
+
+def permissions():
+    """Return list of "app_label.codename" permissions carried by
+    tokens; position in SUBSCRIPTION_ENTITLEMENT_PERMISSIONS is the bit
+    number, so entries may only be appended."""
+    return list(_setting('PERMISSIONS', ()))
+
+class Entitlement(object):
+    """Contents of a verified entitlement token."""
+    def __init__(self, user_id, subscription_id, expires, active, permissions):
+        self.user_id = user_id
+        self.subscription_id = subscription_id
+        self.expires = expires
+        self.active = active
+        self.permissions = permissions
+
+    def expired(self, today=None):
+        """Same as UserSubscription.expired()."""
+        today = today or datetime.date.today()
+        return self.expires is not None and (
+            self.expires + datetime.timedelta(SUBSCRIPTION_GRACE_PERIOD) < today )
+
+    def valid(self):
+        return self.active and not self.expired()
+
+    def has_perm(self, perm):
+        return self.valid() and perm in self.permissions
+
+def payload(us):
+    """Return token payload for UserSubscription `us'."""
+    perms = plan_permissions.get(us.subscription_id)
+    bits = 0
+    for i, perm in enumerate(permissions()):
+        if perm in perms:
+            bits |= 1 << i
+    return '%d.%d.%s.%d.%x' % (us.user_id, us.subscription_id,
+                               us.expires and us.expires.strftime('%Y%m%d') or '',
+                               us.active and 1 or 0, bits)
+
+def issue(us):
+    """Return signed entitlement token for UserSubscription `us'."""
+    return signing.TimestampSigner(salt=SALT).sign(payload(us))
+
+def parse(value):
+    user_id, subscription_id, expires, active, bits = value.split('.')
+    bits = int(bits, 16)
+    return Entitlement(int(user_id), int(subscription_id),
+                       expires and datetime.datetime.strptime(expires, '%Y%m%d').date() or None,
+                       active == '1',
+                       frozenset([ perm for i, perm in enumerate(permissions())
+                                   if bits & (1 << i) ]))
+
+def verify(token, max_age=None):
+    """Return Entitlement from `token', or None if token is malformed,
+    forged or older than `max_age' seconds (default
+    SUBSCRIPTION_ENTITLEMENT_MAX_AGE, one day)."""
+    if max_age is None:
+        max_age = token_max_age()
+    try:
+        return parse(signing.TimestampSigner(salt=SALT).unsign(token, max_age=max_age))
+    except (signing.BadSignature, ValueError):
+        return None
+
+def token_payload(token):
+    """Return payload part of `token', without verifying it."""
+    return token.rsplit(':', 2)[0]      # value:timestamp:signature
+
+def token_max_age():
+    return _setting('MAX_AGE', 24 * 3600)
+
+def cookie_name():
+    return _setting('COOKIE', 'subscription_entitlement')
+
+def request_token(request):
+    """Return entitlement token sent with `request' in X-Subscription-
+    Entitlement header or SUBSCRIPTION_ENTITLEMENT_COOKIE cookie."""
+    return request.META.get('HTTP_X_SUBSCRIPTION_ENTITLEMENT') or \
+        request.COOKIES.get(cookie_name())
+
+
+def entitlement_required(perm=None):
+    """View decorator allowing only requests with a valid entitlement
+    token (granting `perm', if given); sets `request.entitlement'."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            token = request_token(request)
+            entitlement = token and verify(token)
+            if not entitlement or not entitlement.valid() or \
+                    (perm is not None and not entitlement.has_perm(perm)):
+                return HttpResponseForbidden()
+            request.entitlement = entitlement
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
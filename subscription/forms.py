@@ -3,6 +3,10 @@
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
+from django.utils.safestring import mark_safe
+
+from subscription import utils
+from subscription.catalog import catalog
 
 _formclass = getattr(settings, 'SUBSCRIPTION_PAYPAL_FORM', 'paypal.standard.forms.PayPalPaymentsForm')
 _formclass_dot = _formclass.rindex('.')
@@ -11,25 +15,42 @@ PayPalForm = getattr(_formclass_module, _formclass[_formclass_dot+1:])
 
 # https://cms.paypal.com/us/cgi-bin/?cmd=_render-content&content_ID=developer/e_howto_html_Appx_websitestandard_htmlvariables
 
-def _paypal_form_args(upgrade_subscription=False, **kwargs):
-    "Return PayPal form arguments derived from kwargs."
+def paypal_form_base():
+    """Return site name and URLs shared by all PayPal forms.
+
+    Compute it once and pass as `base' to _paypal_form() when
+    building many forms."""
+    site = Site.objects.get_current()
     def _url(rel):
         if not rel.startswith('/'): rel = '/'+rel
-        return 'http://%s%s' % ( Site.objects.get_current().domain, rel )
+        return 'http://%s%s' % ( site.domain, rel )
+
+    return { 'site_name': site.name,
+             'notify_url': _url(reverse('paypal-ipn')),
+             'return_url': _url(reverse('subscription_done')),
+             'change_return_url': _url(reverse('subscription_change_done')),
+             'cancel_return': _url(reverse("subscription_cancel")) }
+
+def _paypal_form_args(upgrade_subscription=False, base=None, **kwargs):
+    "Return PayPal form arguments derived from kwargs."
+    if base is None: base = paypal_form_base()
 
-    if upgrade_subscription: returl = reverse('subscription_change_done')
-    else: returl = reverse('subscription_done')
+    if upgrade_subscription: returl = base['change_return_url']
+    else: returl = base['return_url']
 
     rv = settings.SUBSCRIPTION_PAYPAL_SETTINGS.copy()
-    rv.update( notify_url = _url(reverse('paypal-ipn')),
-               return_url = _url(returl),
-               cancel_return = _url(reverse("subscription_cancel")),
+    rv.update( notify_url = base['notify_url'],
+               return_url = returl,
+               cancel_return = base['cancel_return'],
                **kwargs)
     return rv
 
-def _paypal_form(subscription, user, upgrade_subscription=False, extra=None):
+def _paypal_form(subscription, user, upgrade_subscription=False, extra=None, base=None,
+                 custom=None):
     
-    item_name = '%s: %s' % ( Site.objects.get_current().name, subscription.name )
+    if base is None: base = paypal_form_base()
+    if custom is None: custom = user.id
+    item_name = '%s: %s' % ( base['site_name'], subscription.name )
     
     if subscription.recurrence_unit:
         if not subscription.trial_period:
@@ -45,13 +66,14 @@ def _paypal_form(subscription, user, upgrade_subscription=False, extra=None):
                 cmd='_xclick-subscriptions',
                 item_name=item_name,
                 item_number = subscription.id,
-                custom = user.id,
+                custom = custom,
                 a3=subscription.price,
                 p3=subscription.recurrence_period,
                 t3=subscription.recurrence_unit,
                 src=1,                  # make payments recur
                 sra=1,            # reattempt payment on payment error
                 upgrade_subscription=upgrade_subscription,
+                base=base,
                 modify=upgrade_subscription and 1 or 0, # subscription modification (upgrade/downgrade)
                 **trial)
         
@@ -62,7 +84,45 @@ def _paypal_form(subscription, user, upgrade_subscription=False, extra=None):
     else:
         return PayPalForm(
             initial = _paypal_form_args(
+                base=base,
                 item_name=item_name,
                 item_number = subscription.id,
-                custom = user.id,
+                custom = custom,
                 amount=subscription.price))
+
+
+_button_cache = utils.LRUCache(getattr(settings, 'SUBSCRIPTION_BUTTON_CACHE_SIZE', 256))
+_button_cache_version = None
+_CUSTOM_PLACEHOLDER = 'subscription-custom-placeholder'
+
+def paypal_button(subscription, user, upgrade_subscription=False, sandbox=False, base=None):
+    """Return rendered PayPal button markup for `subscription' and `user'.
+
+    Markup is cached for each plan, upgrade flag and sandbox mode with a
+    placeholder for the per-user `custom' field, which is substituted
+    on every call.  Cache is cleared whenever a Subscription is saved
+    or SUBSCRIPTION_PAYPAL_SETTINGS change.  Encrypted buttons, where
+    `custom' is not visible in the markup, are not cached."""
+    global _button_cache_version
+    if base is None: base = paypal_form_base()
+
+    version = (catalog.current_version(), sorted(settings.SUBSCRIPTION_PAYPAL_SETTINGS.items()))
+    if version != _button_cache_version:
+        _button_cache.clear()
+        _button_cache_version = version
+
+    key = (subscription.id, subscription.name, subscription.price,
+           subscription.recurrence_period, subscription.recurrence_unit,
+           subscription.trial_period, subscription.trial_unit,
+           bool(upgrade_subscription), sandbox, tuple(sorted(base.items())))
+    markup = _button_cache.get(key)
+    if markup is None:
+        form = _paypal_form(subscription, None, upgrade_subscription=upgrade_subscription,
+                            base=base, custom=_CUSTOM_PLACEHOLDER)
+        markup = sandbox and form.sandbox() or form.render()
+        if _CUSTOM_PLACEHOLDER not in markup:
+            form = _paypal_form(subscription, user,
+                                upgrade_subscription=upgrade_subscription, base=base)
+            return sandbox and form.sandbox() or form.render()
+        _button_cache.set(key, markup)
+    return mark_safe(markup.replace(_CUSTOM_PLACEHOLDER, str(user.id)))
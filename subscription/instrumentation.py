@@ -0,0 +1,178 @@
+### -*- coding: utf-8 -*- ####################################################
+""" timing and query counts of signals, handlers and subscription changes """
+
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
+from django.utils.importlib import import_module
+
+class LoggingSink(object):
+    """Log every measurement to `subscription.instrumentation' logger
+    at DEBUG level."""
+    def __init__(self, logger='subscription.instrumentation'):
+        self.log = logging.getLogger(logger)
+
+    def record(self, name, seconds, queries):
+        self.log.debug('%s: %.3f ms, %s queries', name, seconds * 1000, queries)
+
+class MemorySink(object):
+    """
+        In-memory histogram of measurements per name: call count, total
+        and maximum time, total query count and counts of calls in
+        BUCKETS (upper bounds in milliseconds).
+    """
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, None)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def record(self, name, seconds, queries):
+        ms = seconds * 1000
+        bucket = 0
+        while self.BUCKETS[bucket] is not None and ms > self.BUCKETS[bucket]:
+            bucket += 1
+        with self._lock:
+            try:
+                histogram = self.histograms[name]
+            except KeyError:
+                histogram = self.histograms[name] = {
+                    'count': 0, 'total_ms': 0., 'max_ms': 0., 'queries': 0,
+                    'buckets': [0] * len(self.BUCKETS)}
+            histogram['count'] += 1
+            histogram['total_ms'] += ms
+            histogram['max_ms'] = max(histogram['max_ms'], ms)
+            histogram['queries'] += queries or 0
+            histogram['buckets'][bucket] += 1
+
+    def stats(self):
+        """Return dictionary mapping names to copies of histograms, with
+        `mean_ms' added."""
+        with self._lock:
+            return dict((name, dict(histogram, buckets=list(histogram['buckets']),
+                                    mean_ms=histogram['total_ms'] / histogram['count']))
+                        for name, histogram in self.histograms.items())
+
+class StatsdSink(object):
+    """Send measurements as statsd timers (and query counters) in UDP
+    datagrams; send errors are ignored."""
+    def __init__(self, host='127.0.0.1', port=8125, prefix='subscription'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, name, seconds, queries):
+        name = '%s.%s' % (self.prefix, name) if self.prefix else name
+        data = '%s:%.3f|ms' % (name, seconds * 1000)
+        if queries is not None:
+            data += '\n%s.queries:%d|c' % (name, queries)
+        try:
+            self.socket.sendto(data, self.address)
+        except socket.error:
+            pass
+
+SINKS = {
+    'logging': LoggingSink,
+    'memory': MemorySink,
+    'statsd': StatsdSink,
+    }
+
+def sink_from_settings():
+    """Return sink named by SUBSCRIPTION_INSTRUMENTATION setting: one of
+    SINKS, or dotted path of a sink class, created with
+    SUBSCRIPTION_INSTRUMENTATION_OPTIONS keyword arguments.  Return None
+    (instrumentation disabled) if the setting is empty."""
+    name = getattr(settings, 'SUBSCRIPTION_INSTRUMENTATION', None)
+    if not name:
+        return None
+    try:
+        cls = SINKS[name]
+    except KeyError:
+        module, attr = name.rsplit('.', 1)
+        cls = getattr(import_module(module), attr)
+    return cls(**getattr(settings, 'SUBSCRIPTION_INSTRUMENTATION_OPTIONS', {}))
+
+_sink = sink_from_settings()
+
+def get_sink():
+    return _sink
+
+def set_sink(sink):
+    """Replace current sink (None disables instrumentation); return
+    previous one."""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def _query_count():
+    """Return number of queries made so far on default connection, or
+    None if queries are not logged (DEBUG is off)."""
+    if connection.use_debug_cursor or (connection.use_debug_cursor is None and settings.DEBUG):
+        return len(connection.queries)
+    return None
+
+@contextmanager
+def timer(name):
+    """Measure time and query count of the block as `name'."""
+    sink = _sink
+    if sink is None:
+        yield
+        return
+    queries = _query_count()
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        if queries is not None:
+            queries = (_query_count() or 0) - queries
+        sink.record(name, seconds, queries)
+
+def timed(name):
+    """Decorator measuring every call of the function as `name'."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def receiver_name(receiver):
+    return '%s.%s' % (getattr(receiver, '__module__', None),
+                      getattr(receiver, '__name__', type(receiver).__name__))
+
+class InstrumentedSignal(Signal):
+    """Signal measuring its dispatch as `signal.NAME' and every
+    receiver as `signal.NAME.MODULE.FUNCTION'."""
+    def __init__(self, name, providing_args=None):
+        super(InstrumentedSignal, self).__init__(providing_args)
+        self.name = name
+
+    def send(self, sender, **named):
+        if _sink is None or not self.receivers:
+            return super(InstrumentedSignal, self).send(sender, **named)
+        responses = []
+        prefix = 'signal.' + self.name
+        with timer(prefix):
+            for receiver in self._live_receivers(_make_id(sender)):
+                with timer('%s.%s' % (prefix, receiver_name(receiver))):
+                    response = receiver(signal=self, sender=sender, **named)
+                responses.append((receiver, response))
+        return responses
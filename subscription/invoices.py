@@ -0,0 +1,316 @@
+### -*- coding: utf-8 -*- ####################################################
+""" PDF invoices rendered in worker processes and cached on disk """
+
+import atexit
+import csv
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+import StringIO
+
+from django.conf import settings
+from django.db.models import Q
+from django.template import loader, TemplateDoesNotExist
+from django.utils.dateparse import parse_datetime
+
+from subscription import signals
+from subscription.journal import journal
+from subscription.models import Transaction
+
+log = logging.getLogger(__name__)
+
+def _setting(name, default):
+    return getattr(settings, 'SUBSCRIPTION_INVOICE_' + name, default)
+
+def invoice_template():
+    return _setting('TEMPLATE', 'subscription/invoice.html')
+
+def html_to_pdf(html):
+    """Convert HTML (UTF-8 string) to PDF.  Run in worker processes."""
+    import ho.pisa as pisa
+    dest = StringIO.StringIO()
+    pdf_context = pisa.pisaDocument(html, dest)
+    if pdf_context.err:
+        raise RuntimeError(pdf_context.log)
+    return dest.getvalue()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def start_pool(workers=None):
+    """Start pool of `workers' rendering processes (default
+    SUBSCRIPTION_INVOICE_WORKERS setting, 2) unless one is running;
+    return the pool, or None if number of workers is 0.
+
+    Call at startup of each process that should render invoices in
+    background (e.g. from WSGI script, after the server forked);
+    without a pool, invoices are rendered in the calling process."""
+    global _pool
+    if workers is None:
+        workers = _setting('WORKERS', 2)
+    with _pool_lock:
+        if _pool is None and workers:
+            _pool = multiprocessing.Pool(workers)
+        return _pool
+
+def stop_pool():
+    """Close the pool, waiting for queued renders to be stored."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        pool.join()
+atexit.register(stop_pool)
+
+def get_pool():
+    """Return pool started with start_pool(), or None."""
+    return _pool
+
+class InvoicePending(Exception):
+    """Invoice is still being rendered by worker pool."""
+
+_template_digests = {}
+
+def template_digest(template_name=None):
+    """Return hash of invoice template source, computed once per process."""
+    template_name = template_name or invoice_template()
+    try:
+        return _template_digests[template_name]
+    except KeyError:
+        pass
+    loader.find_template(template_name)         # initializes template loaders
+    source = template_name
+    loaders = list(loader.template_source_loaders)
+    while loaders:
+        source_loader = loaders.pop(0)
+        loaders[:0] = getattr(source_loader, 'loaders', [])
+        try:
+            source = source_loader.load_template_source(template_name)[0]
+        except (TemplateDoesNotExist, NotImplementedError):
+            continue
+        break
+    digest = _template_digests[template_name] = \
+        hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return digest
+
+def invoice_path(transaction_id):
+    """Return path of cached PDF for Transaction with `transaction_id'."""
+    return os.path.join(_setting('CACHE_DIR', os.path.join(tempfile.gettempdir(),
+                                                           'subscription-invoices')),
+                        '%d-%s.pdf' % (transaction_id, template_digest()))
+
+def render_html(transaction):
+    return loader.render_to_string(invoice_template(), {
+            'transaction': transaction, 'user': transaction.user}).encode('utf-8')
+
+def _store(path, pdf):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        os.write(fd, pdf)
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+def invoice_file(transaction_id, timeout=None):
+    """Return path of PDF invoice for Transaction with
+    `transaction_id', rendering it first if it is not cached.
+
+    Worker pool rendering is waited for at most `timeout' seconds
+    (default SUBSCRIPTION_INVOICE_RENDER_TIMEOUT setting, 10); then
+    InvoicePending is raised and invoice is stored once rendered."""
+    path = invoice_path(transaction_id)
+    if not os.path.exists(path):
+        transaction = Transaction.objects.history() \
+            .select_related('user', 'subscription', 'ipn').get(id=transaction_id)
+        html = render_html(transaction)
+        pool = get_pool()
+        if pool is None:
+            _store(path, html_to_pdf(html))
+        else:
+            result = pool.apply_async(html_to_pdf, (html,),
+                                      callback=lambda pdf: _store(path, pdf))
+            result.wait(timeout or _setting('RENDER_TIMEOUT', 10))
+            if not result.ready():
+                raise InvoicePending(transaction_id)
+            result.get()                # raises rendering error
+    return path
+
+def pregenerate(transaction):
+    """Render PDF invoice for `transaction' in background, if worker
+    pool is running and invoice is not cached yet; return AsyncResult
+    of rendering, or None."""
+    pool = get_pool()
+    path = invoice_path(transaction.id)
+    if pool is None or os.path.exists(path):
+        return None
+    html = render_html(transaction)
+    return pool.apply_async(html_to_pdf, (html,), callback=lambda pdf: _store(path, pdf))
+
+
+def payments_recorded(transactions, **kwargs):
+    """Pre-generate invoices for payments (sent with `paid' signal) once
+    the database transaction writing their Transaction rows commits."""
+    payments = [t for t in transactions if t.event == Transaction.EVENT_PAYMENT]
+    if payments:
+        journal.after_commit(_pregenerate_payments,
+                             [t.pk for t in payments if t.pk is not None],
+                             [t.ipn_id for t in payments if t.pk is None and t.ipn_id is not None])
+
+def _pregenerate_payments(ids, ipns):
+    # rows are read back: those rolled back are not rendered
+    try:
+        if get_pool() is None:
+            return
+        for transaction in Transaction.objects.select_related('user', 'subscription', 'ipn') \
+                .filter(Q(id__in=ids) | Q(ipn__in=ipns), event=Transaction.EVENT_PAYMENT):
+            pregenerate(transaction)
+    except Exception:
+        # never fail payment processing because of invoice
+        log.exception('Cannot pre-generate invoice')
+signals.transactions_recorded.connect(payments_recorded)
+
+
+def payments(start=None, end=None, users=None):
+    """Return TransactionHistory of payment transactions made on or
+    after `start' and before `end' dates, by `users' (sequence of ids or
+    User objects)."""
+    queryset = Transaction.objects.history().filter(event=Transaction.EVENT_PAYMENT)
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    if users:
+        queryset = queryset.filter(user__in=users)
+    return queryset
+
+HISTORY_FIELDS = ('id', 'timestamp', 'amount', 'subscription', 'subscription__name')
+
+def format_cursor(transaction):
+    """Return history cursor pointing past `transaction'."""
+    return '%s,%d' % (transaction.timestamp.isoformat(), transaction.id)
+
+def parse_cursor(cursor):
+    """Return (timestamp, id) pair from history cursor; raise
+    ValueError if it is malformed."""
+    timestamp, pk = cursor.rsplit(',', 1)
+    timestamp = parse_datetime(timestamp)
+    if timestamp is None:
+        raise ValueError(cursor)
+    return timestamp, int(pk)
+
+def history(user, before=None, size=None):
+    """Return (payments, next_cursor) for a page of `user' payments,
+    newest first, starting after `before' cursor.
+
+    Only HISTORY_FIELDS are loaded; `next_cursor' is None on last page."""
+    size = size or _setting('PAGE_SIZE', 25)
+    queryset = payments(users=[user]).select_related('subscription').only(*HISTORY_FIELDS)
+    if before:
+        timestamp, pk = parse_cursor(before)
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) |
+                                   Q(timestamp=timestamp, id__lt=pk))
+    page = list(queryset[:size + 1])
+    if len(page) > size:
+        del page[size:]
+        return page, format_cursor(page[-1])
+    return page, None
+
+def _chunks(queryset, size):
+    """Yield lists of objects from `queryset' (QuerySet or
+    TransactionHistory), walking it by primary key so that at most
+    `size' rows are in memory.  values_list() rows must start with
+    the primary key."""
+    for part in getattr(queryset, 'querysets', [queryset]):
+        last_pk = 0
+        while True:
+            chunk = list(part.filter(pk__gt=last_pk).order_by('pk')[:size].iterator())
+            if not chunk:
+                break
+            last_pk = chunk[-1][0] if isinstance(chunk[-1], tuple) else chunk[-1].pk
+            yield chunk
+
+def iter_invoices(queryset, chunk_size=100):
+    """Yield (transaction, PDF) pairs for all transactions in `queryset'.
+
+    Invoices missing from cache are rendered in worker pool, a chunk at
+    a time, and stored in cache."""
+    pool = get_pool()
+    for chunk in _chunks(queryset.select_related('user', 'subscription', 'ipn'), chunk_size):
+        pending = []
+        for transaction in chunk:
+            path = invoice_path(transaction.id)
+            if os.path.exists(path):
+                pending.append((transaction, path, None))
+            elif pool is None:
+                pending.append((transaction, path, html_to_pdf(render_html(transaction))))
+            else:
+                pending.append((transaction, path,
+                                pool.apply_async(html_to_pdf, (render_html(transaction),))))
+        for transaction, path, pdf in pending:
+            if pdf is None:
+                with open(path, 'rb') as f:
+                    pdf = f.read()
+            else:
+                if pool is not None:
+                    pdf = pdf.get()
+                _store(path, pdf)
+            yield transaction, pdf
+
+
+class _StreamBuffer(object):
+    """Write-only file object collecting output of zipfile and csv
+    writers between reads."""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def read(self):
+        data, self.chunks = ''.join(self.chunks), []
+        return data
+
+def iter_zip(queryset):
+    """Yield ZIP archive of PDF invoices for `queryset' piece by piece."""
+    buffer = _StreamBuffer()
+    archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    for transaction, pdf in iter_invoices(queryset):
+        archive.writestr('invoice-%d.pdf' % transaction.id, pdf)
+        yield buffer.read()
+    archive.close()
+    yield buffer.read()
+
+CSV_FIELDS = ('id', 'timestamp', 'user', 'user__username', 'subscription__name',
+              'amount', 'ipn__txn_id')
+
+def iter_csv(queryset, chunk_size=1000):
+    """Yield CSV summary of transactions in `queryset' line by line."""
+    buffer = _StreamBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for rows in _chunks(queryset.values_list(*CSV_FIELDS), chunk_size):
+        for row in rows:
+            writer.writerow([unicode(value if value is not None else '').encode('utf-8')
+                             for value in row])
+        yield buffer.read()
+    yield buffer.read()
@@ -0,0 +1,134 @@
+### -*- coding: utf-8 -*- ####################################################
+""" durable queue of PayPal IPN signals, handled by worker processes """
+
+import datetime
+import logging
+import traceback
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+
+from subscription.models import QueuedIPN
+
+log = logging.getLogger(__name__)
+
+def _setting(name, default):
+    return getattr(settings, 'SUBSCRIPTION_IPN_QUEUE_' + name, default)
+
+def enabled():
+    return getattr(settings, 'SUBSCRIPTION_IPN_QUEUE', False)
+
+handlers = {}
+
+def queued(handler):
+    """Decorator registering IPN signal `handler'.  When
+    SUBSCRIPTION_IPN_QUEUE setting is true, calling the returned
+    function only puts the IPN in the queue."""
+    handlers[handler.__name__] = handler
+    @wraps(handler)
+    def wrapper(sender, **kwargs):
+        if enabled():
+            enqueue(sender, handler.__name__)
+        else:
+            return handler(sender, **kwargs)
+    return wrapper
+
+def ipn_user_id(ipn):
+    try:
+        return int(ipn.custom)
+    except (TypeError, ValueError):
+        return None
+
+def enqueue(ipn, handler):
+    """Queue saved PayPalIPN `ipn' for handler registered as `handler'."""
+    return QueuedIPN.objects.create(ipn=ipn, handler=handler, user_id=ipn_user_id(ipn))
+
+_WAITING_SQL = """NOT EXISTS (
+    SELECT 1 FROM subscription_queuedipn waiting
+    WHERE waiting.user_id = subscription_queuedipn.user_id
+      AND waiting.id < subscription_queuedipn.id
+      AND waiting.dead = %s AND waiting.next_attempt > %s)"""
+
+def due(partition=0, partitions=1, now=None):
+    """Return QuerySet of IPNs due at `now' in `partition' (user id
+    modulo `partitions'), oldest first, leaving out IPNs of users whose
+    older IPN waits for retry."""
+    now = now or datetime.datetime.now()
+    where, params = [_WAITING_SQL], [False, now]
+    if partitions > 1:
+        where.append('COALESCE(subscription_queuedipn.user_id, 0) %% %s = %s')
+        params.extend([partitions, partition])
+    return QueuedIPN.objects.filter(dead=False, next_attempt__lte=now) \
+        .extra(where=where, params=params).order_by('id')
+
+def _claim(queued_ipn):
+    """Lock `queued_ipn' row; return false if it was handled or retried
+    by another worker meanwhile, or user's older IPN is still queued.
+
+    Must be called inside a database transaction."""
+    if not list(QueuedIPN.objects.select_for_update()
+                .filter(id=queued_ipn.id, attempts=queued_ipn.attempts)
+                .values_list('id', flat=True)):
+        return False
+    return queued_ipn.user_id is None or not QueuedIPN.objects.filter(
+        user_id=queued_ipn.user_id, id__lt=queued_ipn.id, dead=False).exists()
+
+def handle(queued_ipn, now=None):
+    """Run handler of `queued_ipn' and delete it in one database
+    transaction; on failure, schedule retry or mark it dead.  Return
+    true on success, false on failure and None if the IPN was claimed
+    by another worker (see _claim())."""
+    try:
+        with transaction.commit_on_success():
+            if not _claim(queued_ipn):
+                return None
+            # deleted first: handler's own journal.atomic() commits the
+            # deletion together with handler's writes
+            QueuedIPN.objects.filter(id=queued_ipn.id).delete()
+            handlers[queued_ipn.handler](queued_ipn.ipn)
+    except Exception:
+        log.exception('Cannot handle queued IPN %d', queued_ipn.id)
+        attempts = queued_ipn.attempts + 1
+        changes = {'attempts': attempts, 'last_error': traceback.format_exc()}
+        if attempts >= _setting('MAX_ATTEMPTS', 5):
+            changes['dead'] = True
+        else:
+            changes['next_attempt'] = (now or datetime.datetime.now()) + datetime.timedelta(
+                seconds=_setting('RETRY_DELAY', 60) * 2 ** (attempts - 1))
+        # update, not save: row deleted by committed handler stays deleted
+        with transaction.commit_on_success():
+            QueuedIPN.objects.filter(id=queued_ipn.id,
+                                     attempts=queued_ipn.attempts).update(**changes)
+        return False
+    return True
+
+def process(partition=0, partitions=1, limit=100):
+    """Handle up to `limit' due IPNs of `partition', oldest first;
+    return number of IPNs handled, successfully or not.
+
+    IPNs of one user are handled in order: after a failure, the rest of
+    user's IPNs wait until the failed one is retried.  IPNs handled by
+    an overlapping run are skipped.  Failed IPN is
+    retried after SUBSCRIPTION_IPN_QUEUE_RETRY_DELAY seconds (default
+    60), doubled on every attempt, and marked dead after
+    SUBSCRIPTION_IPN_QUEUE_MAX_ATTEMPTS attempts (default 5)."""
+    now = datetime.datetime.now()
+    failed = set()
+    handled = 0
+    for queued_ipn in due(partition, partitions, now).select_related('ipn')[:limit]:
+        if queued_ipn.user_id is not None and queued_ipn.user_id in failed:
+            continue
+        result = handle(queued_ipn, now)
+        if result is None:
+            continue
+        if not result:
+            failed.add(queued_ipn.user_id)
+        handled += 1
+    return handled
+
+def requeue(queryset):
+    """Put IPNs in `queryset' (e.g. dead ones) back for immediate
+    handling; return their number."""
+    return queryset.update(dead=False, attempts=0, last_error='',
+                           next_attempt=datetime.datetime.now())
@@ -0,0 +1,138 @@
+### -*- coding: utf-8 -*- ####################################################
+""" buffered writer for Transaction rows """
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from subscription import signals
+
+class TransactionJournal(threading.local):
+    """
+        Collects model instances (Transaction rows) written during a unit
+        of work and inserts them with one bulk_create per model when the
+        outermost unit ends, or when an atomic() unit commits.
+
+        Outside of any unit of work, or when SUBSCRIPTION_JOURNAL_IMMEDIATE
+        setting is true, instances are saved right away.  Written
+        instances are sent with signals.transactions_recorded, in the
+        same database transaction; instances inserted in bulk have no
+        primary key set.
+
+        Callbacks registered with after_commit() in a unit of work, or
+        while a flush outside of units writes, run once it is over.
+    """
+    def __init__(self):
+        self.entries = []
+        self.depth = 0
+        self.flushing = False
+        self.callbacks = []
+
+    def immediate(self):
+        return self.depth == 0 or getattr(settings, 'SUBSCRIPTION_JOURNAL_IMMEDIATE', False)
+
+    def add(self, obj):
+        """Record unsaved model instance `obj'."""
+        self.entries.append(obj)
+        if self.immediate():
+            self.flush(len(self.entries) - 1)
+        return obj
+
+    def extend(self, objs):
+        """Record a sequence of unsaved model instances."""
+        mark = len(self.entries)
+        self.entries.extend(objs)
+        if self.immediate():
+            self.flush(mark)
+
+    def after_commit(self, func, *args):
+        """Call `func(*args)' when atomic() or a flush commits its
+        database transaction, or when the outermost unit of work ends;
+        right away outside of units of work (also in a transaction
+        managed by other code, whose commit cannot be seen here)."""
+        if self.depth > 0 or self.flushing:
+            self.callbacks.append((func, args))
+        else:
+            func(*args)
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for func, args in callbacks:
+            func(*args)
+
+    def flush(self, mark=0):
+        """Write instances buffered since `mark' (all by default)."""
+        entries = self.entries[mark:]
+        del self.entries[mark:]
+        if not entries:
+            return
+        if transaction.is_managed():
+            self._write(entries)
+        else:
+            # rows and listeners' writes (rollups, schedule) together
+            self.flushing = True
+            try:
+                with transaction.commit_on_success():
+                    self._write(entries)
+            finally:
+                self.flushing = False
+                self.run_callbacks()
+
+    def _write(self, entries):
+        if len(entries) == 1:
+            entries[0].save()
+        else:
+            by_model = {}
+            for obj in entries:
+                by_model.setdefault(type(obj), []).append(obj)
+            for model, objs in by_model.items():
+                model._default_manager.bulk_create(objs)
+        signals.transactions_recorded.send(self, transactions=entries)
+
+    def begin(self):
+        self.depth += 1
+
+    def end(self, flush=True, mark=0):
+        """Close unit of work.  Buffer is flushed when the outermost unit
+        is closed; if `flush' is false, instances buffered since `mark'
+        are dropped instead."""
+        self.depth -= 1
+        if not flush:
+            del self.entries[mark:]
+        elif self.depth == 0:
+            self.flush()
+        if self.depth == 0:
+            self.run_callbacks()
+
+    @contextmanager
+    def batch(self):
+        """Buffer writes made in the block, flush them at its end."""
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.end()
+
+    @contextmanager
+    def atomic(self, using=None):
+        """Run the block in a database transaction, flushing writes
+        buffered in the block just before commit, also when nested in
+        another unit of work.  Writes buffered in the block are dropped
+        if it raises."""
+        try:
+            with transaction.commit_on_success(using=using):
+                mark = len(self.entries)
+                self.begin()
+                try:
+                    yield self
+                    self.flush(mark)
+                except:
+                    self.end(flush=False, mark=mark)
+                    raise
+                self.end()
+        finally:
+            self.run_callbacks()
+
+journal = TransactionJournal()
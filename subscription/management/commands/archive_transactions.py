@@ -0,0 +1,75 @@
+### -*- coding: utf-8 -*- ####################################################
+""" move old transactions to archive table in batches """
+
+import datetime
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from subscription.models import ArchivedTransaction, Transaction
+
+FIELDS = [ field.attname for field in Transaction._meta.fields ]
+
+class Command(BaseCommand):
+    help = ("Moves transactions older than SUBSCRIPTION_ARCHIVE_DAYS days "
+            "(default 365) to the archive table.")
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', dest='days',
+                    default=getattr(settings, 'SUBSCRIPTION_ARCHIVE_DAYS', 365),
+                    help='Archive transactions older than this many days.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of transactions moved per database transaction.'),
+        make_option('--sleep', type='float', dest='sleep', default=0,
+                    help='Seconds to pause between batches.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report how many transactions would be archived.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative.')
+
+        cutoff = datetime.datetime.now() - datetime.timedelta(options['days'])
+        queryset = Transaction.objects.filter(timestamp__lt=cutoff)
+        verbosity = int(options.get('verbosity', 1))
+
+        if options['dry_run']:
+            self.stdout.write('%d transaction(s) would be archived.\n' % queryset.count())
+            return
+
+        moved, last_pk = 0, 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                        .values(*FIELDS)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1]['id']
+            self.move(rows)
+            moved += len(rows)
+            if verbosity > 1:
+                self.stdout.write('%d transaction(s) archived, last id %d\n' % (moved, last_pk))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if verbosity:
+            self.stdout.write('%d transaction(s) archived.\n' % moved)
+
+    def move(self, rows):
+        """Copy one batch of Transaction rows (dicts of field values) to
+        archive and delete them, in a single database transaction.
+
+        Rows already present in archive (e.g. left by an interrupted run
+        on a database without transactions) are not copied again."""
+        pks = [ row['id'] for row in rows ]
+        with transaction.commit_on_success():
+            archived = set(ArchivedTransaction.objects.filter(pk__in=pks)
+                                                      .values_list('pk', flat=True))
+            ArchivedTransaction.objects.bulk_create([
+                    ArchivedTransaction(**row) for row in rows if row['id'] not in archived])
+            Transaction.objects.filter(pk__in=pks).delete()
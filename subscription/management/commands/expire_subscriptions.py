@@ -0,0 +1,82 @@
+### -*- coding: utf-8 -*- ####################################################
+""" deactivate or delete expired user subscriptions in batches """
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from subscription.models import Transaction, UserSubscription
+from subscription.journal import journal
+from subscription.usercache import user_subscriptions
+
+class Command(BaseCommand):
+    help = ("Deactivates (or deletes, with --delete) user subscriptions that "
+            "expired more than SUBSCRIPTION_GRACE_PERIOD days ago.")
+    option_list = BaseCommand.option_list + (
+        make_option('--delete', action='store_true', dest='delete', default=False,
+                    help='Delete expired subscriptions instead of deactivating them.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report how many subscriptions would be swept.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of subscriptions handled per database transaction.'),
+        make_option('--date', dest='date', default=None,
+                    help='Treat this date (YYYY-MM-DD) as today.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        today = None
+        if options['date']:
+            try:
+                today = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+
+        queryset = UserSubscription.objects.expired(today)
+        if not options['delete']:
+            queryset = queryset.filter(active=True)
+        verbosity = int(options.get('verbosity', 1))
+
+        if options['dry_run']:
+            self.stdout.write('%d subscription(s) would be %s.\n' % (
+                queryset.count(), options['delete'] and 'deleted' or 'deactivated'))
+            return
+
+        swept, last_pk = 0, 0
+        while True:
+            pks = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            swept += self.sweep(queryset, pks, options['delete'])
+            if verbosity > 1:
+                self.stdout.write('%d subscription(s) swept, last id %d\n' % (swept, last_pk))
+
+        if verbosity:
+            self.stdout.write('%d subscription(s) %s.\n' % (
+                swept, options['delete'] and 'deleted' or 'deactivated'))
+
+    def sweep(self, queryset, pks, delete):
+        """Deactivate or delete subscriptions with `pks' that still match
+        `queryset' once locked (e.g. not renewed meanwhile) and record
+        matching transactions; return their number."""
+        with journal.atomic():
+            chunk = list(queryset.select_for_update().filter(pk__in=pks)
+                         .values_list('pk', 'user', 'subscription'))
+            locked = queryset.filter(pk__in=[ pk for pk, user_id, subscription_id in chunk ])
+            if delete:
+                # REMOVED transactions are recorded on post_delete
+                locked.delete()
+            else:
+                locked.update(active=False)
+                journal.extend([
+                        Transaction(user_id=user_id, subscription_id=subscription_id,
+                                    event=Transaction.EVENT_CANCELLED)
+                        for pk, user_id, subscription_id in chunk])
+        user_subscriptions.invalidate_many([ user_id for pk, user_id, subscription_id in chunk ])
+        return len(chunk)
@@ -0,0 +1,64 @@
+### -*- coding: utf-8 -*- ####################################################
+""" export payment invoices as ZIP archive of PDFs or CSV summary """
+
+import sys
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from subscription import invoices
+
+class Command(BaseCommand):
+    help = ("Writes PDF invoices (as ZIP archive) or CSV summary of payments "
+            "made between --start and --end dates.  Missing invoices are "
+            "rendered by SUBSCRIPTION_INVOICE_WORKERS processes.")
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+                    help='First day of exported period (YYYY-MM-DD).'),
+        make_option('--end', dest='end', default=None,
+                    help='Day after exported period (YYYY-MM-DD).'),
+        make_option('--user', action='append', dest='users', default=[],
+                    help='Export only payments of this user (username); may be repeated.'),
+        make_option('--format', dest='format', default='zip', choices=('zip', 'csv'),
+                    help='Output format: zip (default) or csv.'),
+        make_option('--output', dest='output', default=None,
+                    help='Output file name; standard output by default.'),
+    )
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('start', 'end'):
+            if options[name]:
+                try:
+                    dates[name] = parse_date(options[name])
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    raise CommandError('--%s must be in YYYY-MM-DD format.' % name)
+
+        users = None
+        if options['users']:
+            users = list(User.objects.filter(username__in=options['users'])
+                         .values_list('id', flat=True))
+            if len(users) != len(set(options['users'])):
+                raise CommandError('Unknown user in --user.')
+
+        queryset = invoices.payments(users=users, **dates)
+        if options['format'] == 'zip':
+            chunks = invoices.iter_zip(queryset)
+        else:
+            chunks = invoices.iter_csv(queryset)
+
+        own_pool = options['format'] == 'zip' and invoices.get_pool() is None \
+            and invoices.start_pool() is not None
+        output = options['output'] and open(options['output'], 'wb') or sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+            if own_pool:
+                invoices.stop_pool()
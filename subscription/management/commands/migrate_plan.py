@@ -0,0 +1,59 @@
+### -*- coding: utf-8 -*- ####################################################
+""" move all users from one plan to another in batches """
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from subscription.models import Subscription
+
+class Command(BaseCommand):
+    args = '<from plan id> <to plan id>'
+    help = ("Moves all user subscriptions of one plan to another, a batch "
+            "at a time, recording `subscribed' transactions.")
+    option_list = BaseCommand.option_list + (
+        make_option('--recompute-expires', action='store_true', dest='recompute_expires',
+                    default=False,
+                    help='Reset expiration dates as for new subscriptions to the target plan.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of subscriptions moved per database transaction.'),
+        make_option('--start-after', type='int', dest='start_after', default=0,
+                    help='Skip user subscriptions with id up to this one (to resume).'),
+        make_option('--sleep', type='float', dest='sleep', default=0,
+                    help='Seconds to pause between batches.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report how many subscriptions would be moved.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Give ids of source and target plans.')
+        try:
+            source, target = [ Subscription.objects.get(id=int(arg)) for arg in args ]
+        except (ValueError, Subscription.DoesNotExist):
+            raise CommandError('Plan ids must be ids of existing plans.')
+        if source.id == target.id:
+            raise CommandError('Source and target plans are the same.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        verbosity = int(options.get('verbosity', 1))
+
+        if options['dry_run']:
+            self.stdout.write('%d subscription(s) would be moved.\n' % (
+                source.user_subscriptions.filter(pk__gt=options['start_after']).count()))
+            return
+
+        moved = 0
+        for last_id, count in source.migrate_users(target, options['recompute_expires'],
+                                                   options['batch_size'],
+                                                   options['start_after']):
+            moved += count
+            if verbosity > 1:
+                self.stdout.write('%d subscription(s) moved, last id %d\n' % (moved, last_id))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if verbosity:
+            self.stdout.write('%d subscription(s) moved from %s to %s.\n' % (
+                moved, source, target))
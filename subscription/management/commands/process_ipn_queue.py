@@ -0,0 +1,59 @@
+### -*- coding: utf-8 -*- ####################################################
+""" handle queued PayPal IPNs in worker processes partitioned by user """
+
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from subscription import ipnqueue
+
+class Command(BaseCommand):
+    help = ("Handles PayPal IPNs queued when SUBSCRIPTION_IPN_QUEUE is set. "
+            "Each worker process handles users with id modulo --workers "
+            "equal to its number, so IPNs of one user are handled in order.")
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=1,
+                    help='Number of worker processes.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of IPNs fetched at once by a worker.'),
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Exit when no IPN is due instead of waiting for more.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+                    help='Seconds between checks of an empty queue.'),
+    )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be positive.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        verbosity = int(options.get('verbosity', 1))
+
+        if workers == 1:
+            handled = self.work(0, 1, options)
+            if verbosity:
+                self.stdout.write('%d IPN(s) handled.\n' % handled)
+            return
+
+        connection.close()              # not shared with children
+        processes = [ multiprocessing.Process(target=self.work, args=(partition, workers, options))
+                      for partition in range(workers) ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    def work(self, partition, partitions, options):
+        """Handle IPNs of `partition'; return their number (with --once)."""
+        handled = 0
+        while True:
+            count = ipnqueue.process(partition, partitions, options['batch_size'])
+            handled += count
+            if not count:
+                if options['once']:
+                    return handled
+                time.sleep(options['interval'])
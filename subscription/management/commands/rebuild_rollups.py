@@ -0,0 +1,62 @@
+### -*- coding: utf-8 -*- ####################################################
+""" rebuild daily transaction rollups from transaction history """
+
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from subscription import rollups
+from subscription.models import ArchivedTransaction, Transaction
+
+def _parse_date(value, option):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('%s must be in YYYY-MM-DD format.' % option)
+
+class Command(BaseCommand):
+    help = ("Rebuilds daily rollups of transactions (including archived "
+            "ones), a chunk of days at a time.")
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+                    help='First day to rebuild (YYYY-MM-DD); default is the oldest transaction.'),
+        make_option('--end', dest='end', default=None,
+                    help='Last day to rebuild (YYYY-MM-DD); default is today.'),
+        make_option('--chunk-days', type='int', dest='chunk_days', default=30,
+                    help='Number of days rebuilt per database transaction.'),
+        make_option('--sleep', type='float', dest='sleep', default=0,
+                    help='Seconds to pause between chunks.'),
+    )
+
+    def handle(self, *args, **options):
+        chunk_days = options['chunk_days']
+        if chunk_days < 1:
+            raise CommandError('--chunk-days must be positive.')
+        end = datetime.date.today()
+        if options['end']:
+            end = _parse_date(options['end'], '--end')
+        if options['start']:
+            start = _parse_date(options['start'], '--start')
+        else:
+            oldest = [ model.objects.aggregate(Min('timestamp'))['timestamp__min']
+                       for model in (Transaction, ArchivedTransaction) ]
+            oldest = [ timestamp.date() for timestamp in oldest if timestamp is not None ]
+            start = min(oldest) if oldest else end
+        verbosity = int(options.get('verbosity', 1))
+
+        days = 0
+        while start <= end:
+            chunk_end = min(start + datetime.timedelta(chunk_days), end + datetime.timedelta(1))
+            rollups.rebuild(start, chunk_end)
+            days += (chunk_end - start).days
+            if verbosity > 1:
+                self.stdout.write('Rebuilt rollups up to %s\n' % chunk_end)
+            start = chunk_end
+            if options['sleep'] and start <= end:
+                time.sleep(options['sleep'])
+
+        if verbosity:
+            self.stdout.write('Rollups for %d day(s) rebuilt.\n' % days)
@@ -0,0 +1,55 @@
+### -*- coding: utf-8 -*- ####################################################
+""" pop due scheduled subscription events and send event_due signal """
+
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from subscription import scheduler
+
+class Command(BaseCommand):
+    help = ("Pops scheduled subscription events (reminders, trial ends, "
+            "expiries, grace period ends) that are due and sends "
+            "`event_due' signal for each.")
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of events handled per database transaction.'),
+        make_option('--date', dest='date', default=None,
+                    help='Treat this date (YYYY-MM-DD) as today.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep running, checking for due events every --interval seconds.'),
+        make_option('--interval', type='float', dest='interval', default=60,
+                    help='Seconds between checks with --loop.'),
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Recompute schedule of all subscriptions first.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+        today = None
+        if options['date']:
+            try:
+                today = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+        verbosity = int(options.get('verbosity', 1))
+
+        if options['rebuild']:
+            scheduler.rebuild()
+
+        while True:
+            popped = 0
+            while True:
+                events = scheduler.pop_due(today, batch_size)
+                popped += len(events)
+                if len(events) < batch_size:
+                    break
+            if verbosity:
+                self.stdout.write('%d event(s) handled.\n' % popped)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
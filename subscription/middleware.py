@@ -1,13 +1,84 @@
 ### -*- coding: utf-8 -*- ####################################################
 
+from django.conf import settings
+from django.http import HttpRequest
 from django.shortcuts import redirect
 #from django.core.urlresolvers import reverse
 
 from subscription.models import UserSubscription
+from subscription.journal import journal
+from subscription.usercache import user_subscriptions
+from subscription import entitlements
 
-class SubscriptionMiddleware(object):
+class LazySubscription(object):
+    def __get__(self, request, obj_type=None):
+        if request is None:
+            return self
+        if not hasattr(request, '_cached_subscription'):
+            request._cached_subscription = user_subscriptions.get(request.user)
+        return request._cached_subscription
+# defined once, for all requests (and not per request on their class)
+HttpRequest.subscription = LazySubscription()
 
+class SubscriptionMiddleware(object):
+    """
+        `request.subscription' is user's UserSubscription (with its
+        plan) or None, loaded on first access from cache.  Must be
+        placed after AuthenticationMiddleware.  Redirects requests that
+        failed because user has no subscription to subscription list.
+    """
     def process_exception(self, request, exception):
         if type(exception) == UserSubscription.DoesNotExist:
             return redirect('subscription_list')
-        
\ No newline at end of file
+        
+
+class TransactionJournalMiddleware(object):
+    """
+        Buffers Transaction rows written while handling a request and
+        inserts them in bulk when the response is ready.  Rows buffered
+        by a request that raised an exception are dropped.
+    """
+    def process_request(self, request):
+        journal.begin()
+        request._subscription_journal = len(journal.entries)
+
+    def process_exception(self, request, exception):
+        if hasattr(request, '_subscription_journal'):
+            journal.end(flush=False, mark=request._subscription_journal)
+            del request._subscription_journal
+
+    def process_response(self, request, response):
+        if hasattr(request, '_subscription_journal'):
+            del request._subscription_journal
+            journal.end()
+        return response
+
+
+class EntitlementMiddleware(object):
+    """
+        Keeps signed entitlement cookie of authenticated users up to date
+        (see subscription.entitlements).
+
+        Cookie is (re)issued when it is missing, older than half of
+        SUBSCRIPTION_ENTITLEMENT_MAX_AGE, or no longer matches user's
+        subscription and plan permissions, e.g. after subscription
+        signals fired.  Subscription is read from subscription cache.
+    """
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated():
+            return response
+        cookie = entitlements.cookie_name()
+        token = request.COOKIES.get(cookie)
+        us = user_subscriptions.get(user)
+        if us is None:
+            if token:
+                response.delete_cookie(cookie)
+            return response
+        max_age = entitlements.token_max_age()
+        if token and entitlements.verify(token, max_age=max_age // 2) \
+                and entitlements.token_payload(token) == entitlements.payload(us):
+            return response
+        response.set_cookie(cookie, entitlements.issue(us), max_age=max_age, httponly=True,
+                            secure=getattr(settings, 'SESSION_COOKIE_SECURE', False))
+        return response
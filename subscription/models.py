@@ -1,16 +1,91 @@
 ### -*- coding: utf-8 -*- ####################################################
 
 import datetime
+import itertools
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib import auth
+from django.utils import translation
 from django.utils.translation import ungettext, ugettext_lazy as _
 from django.db.models.signals import post_init, post_save, pre_delete, pre_save
 
 from paypal.standard.ipn.models import PayPalIPN 
 
 from subscription import utils, signals
+from subscription.instrumentation import timed
+from subscription.journal import journal
+
+class TransactionHistory(object):
+    """
+        Read-only view of Transaction and ArchivedTransaction rows
+        matching the same filters, newest first.
+
+        Archived rows are older than any row left in Transaction table, so
+        archive is only queried once transactions in Transaction table are
+        exhausted.  Supports chaining of QuerySet methods listed in
+        CHAINED, iteration, slicing, count(), exists() and get().
+    """
+    CHAINED = ('filter', 'exclude', 'select_related', 'only', 'defer',
+               'values', 'values_list')
+
+    def __init__(self, querysets):
+        self.querysets = [qs.order_by('-timestamp', '-id') for qs in querysets]
+
+    def __getattr__(self, name):
+        if name not in self.CHAINED:
+            raise AttributeError(name)
+        def chained(*args, **kwargs):
+            return TransactionHistory([getattr(qs, name)(*args, **kwargs)
+                                       for qs in self.querysets])
+        return chained
+
+    def __iter__(self):
+        for queryset in self.querysets:
+            for obj in queryset.iterator():
+                yield obj
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or k.step is not None \
+                or (k.start or 0) < 0 or k.stop is None or k.stop < 0:
+            raise TypeError('Only [start:stop] slices are supported.')
+        start, stop, result = k.start or 0, k.stop, []
+        for queryset in self.querysets:
+            if start >= stop:
+                break
+            chunk = list(queryset[start:stop])
+            result.extend(chunk)
+            if chunk:
+                start, stop = 0, stop - start - len(chunk)
+            elif start:
+                count = queryset.count()
+                start, stop = start - count, stop - count
+        return result
+
+    def count(self):
+        return sum(qs.count() for qs in self.querysets)
+
+    def exists(self):
+        for queryset in self.querysets:
+            if queryset.exists():
+                return True
+        return False
+
+    def get(self, *args, **kwargs):
+        for queryset in self.querysets:
+            try:
+                return queryset.get(*args, **kwargs)
+            except queryset.model.DoesNotExist:
+                pass
+        raise Transaction.DoesNotExist()
+
+class TransactionManager(models.Manager):
+
+    def history(self):
+        """Return TransactionHistory over both recent and archived
+        transactions."""
+        return TransactionHistory([self.get_query_set(),
+                                   ArchivedTransaction.objects.all()])
 
 class Transaction(models.Model):
     
@@ -45,10 +120,104 @@ class Transaction(models.Model):
                                  null=True, blank=True)
     comment = models.TextField(blank=True, default='')
 
+    objects = TransactionManager()
+
+    class Meta:
+        ordering = ('-timestamp',)
+
+
+class ArchivedTransaction(models.Model):
+    """Transaction moved out of Transaction table by
+    archive_transactions command; keeps original ID."""
+    id = models.IntegerField(primary_key=True)
+    timestamp = models.DateTimeField(db_index=True)
+    subscription = models.ForeignKey('subscription.Subscription', 
+                                     related_name='archived_transactions',
+                                     null=True, blank=True, )
+    user = models.ForeignKey(auth.models.User, null=True, 
+                             blank=True, 
+                             related_name='archived_subscription_transactions')
+    ipn = models.ForeignKey(PayPalIPN, null=True, blank=True,
+                            related_name='archived_transactions')
+    event = models.PositiveSmallIntegerField(choices=Transaction.EVENTS)
+    amount = models.DecimalField(max_digits=64, decimal_places=2,
+                                 null=True, blank=True)
+    comment = models.TextField(blank=True, default='')
+
     class Meta:
         ordering = ('-timestamp',)
 
 
+class DailyRollup(models.Model):
+    """Number and total amount of transactions of one event type, for
+    one subscription, on one day.  Maintained by subscription.rollups."""
+    date = models.DateField()
+    subscription = models.ForeignKey('subscription.Subscription', related_name='rollups',
+                                     null=True, blank=True)
+    # subscription id, or 0 for transactions without plan: NULLs in
+    # unique key would never conflict
+    subscription_key = models.PositiveIntegerField(default=0, editable=False)
+    event = models.PositiveSmallIntegerField(choices=Transaction.EVENTS)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=64, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ( ('date', 'subscription_key', 'event'), )
+        ordering = ('-date',)
+
+
+class ScheduledEvent(models.Model):
+    """Upcoming event in user's subscription (one of each kind per
+    user), kept up to date and popped when due by
+    subscription.scheduler."""
+    KIND_REMINDER = 1
+    KIND_TRIAL_END = 2
+    KIND_EXPIRY = 3
+    KIND_GRACE_END = 4
+
+    KINDS = (
+        (KIND_REMINDER, _('expiry reminder')),
+        (KIND_TRIAL_END, _('trial end')),
+        (KIND_EXPIRY, _('expiry')),
+        (KIND_GRACE_END, _('grace period end')),
+    )
+
+    due = models.DateField()
+    user = models.ForeignKey(auth.models.User, related_name='subscription_events')
+    subscription = models.ForeignKey('subscription.Subscription',
+                                     related_name='scheduled_events')
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+
+    class Meta:
+        unique_together = ( ('user', 'kind'), )
+        ordering = ('due', 'id')
+
+
+class ProcessedPayment(models.Model):
+    """PayPal transaction ids of payments already applied to a
+    subscription; used to ignore resent IPNs."""
+    txn_id = models.CharField(max_length=19, unique=True)
+    ipn = models.ForeignKey(PayPalIPN, null=True, blank=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+
+class QueuedIPN(models.Model):
+    """PayPal IPN signal waiting to be handled by process_ipn_queue
+    command (see subscription.ipnqueue), or given up on (`dead')."""
+    ipn = models.ForeignKey(PayPalIPN, related_name='queued')
+    handler = models.CharField(max_length=64)
+    user_id = models.IntegerField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    dead = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'queued IPN'
+
+
 _recurrence_unit_days = {
     'D' : 1.,
     'W' : 7.,
@@ -113,7 +282,17 @@ class Subscription(models.Model):
     def get_absolute_url(self):
         return ( 'subscription_detail', (), dict(object_id=str(self.id)) )
 
+    def _cached_display(self, name):
+        """Return display string pre-rendered by subscription.catalog
+        for active language, or None."""
+        try:
+            return self._display_cache[translation.get_language()][name]
+        except (AttributeError, KeyError):
+            return None
+
     def get_pricing_display(self):
+        cached = self._cached_display('pricing')
+        if cached is not None: return cached
         if not self.price: return u'Free'
         elif self.recurrence_period:
             return ungettext('%(price).02f / %(unit)s',
@@ -127,6 +306,8 @@ class Subscription(models.Model):
         else: return _('%(price).02f one-time fee') % { 'price':self.price }
 
     def get_recurrence_display(self):
+        cached = self._cached_display('recurrence')
+        if cached is not None: return cached
         if self.recurrence_period:
             return ungettext('One %(unit)s',
                              '%(period)d %(unit_plural)s',
@@ -139,6 +320,8 @@ class Subscription(models.Model):
             return _("No recurrence")
     
     def get_trial_display(self):
+        cached = self._cached_display('trial')
+        if cached is not None: return cached
         if self.trial_period:
             return ungettext('One %(unit)s',
                              '%(period)d %(unit_plural)s',
@@ -150,42 +333,154 @@ class Subscription(models.Model):
         else:
             return _("No trial")
     
+    def initial_expires(self, start=None):
+        """Return expiration date of subscription started at `start'
+        (default now): end of trial period, or of first recurrence
+        period if plan has no trial."""
+        period, unit = (self.trial_period, self.trial_unit) if self.trial_period \
+            else (self.recurrence_period, self.recurrence_unit)
+        return utils.extend_date_by(start or datetime.datetime.now(), period, unit)
+
+    @timed('subscription.subscribe')
     def subscribe(self, user):
+        """Subscribe `user' to this plan and activate the subscription;
+        return UserSubscription.
+
+        New subscription is inserted right away, relying on unique
+        `user' column; if a concurrent call inserted it first, the
+        existing row is locked and updated with a single save()."""
+        sid = transaction.savepoint()
         try:
-            existent = UserSubscription.objects.get(user=user)
-        except UserSubscription.DoesNotExist:
-            return self.user_subscriptions.create(user=user, subscription=self)
+            us = UserSubscription.objects.create(user=user, subscription=self)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
         else:
-            if existent.subscription != self:
-                existent.subscription = self
-                existent.save()
-                signals.subscribed.send(existent)
-            
-            existent.activate()
-                
-            return existent
-    
+            transaction.savepoint_commit(sid)
+            return us
+
+        us = UserSubscription.objects.select_for_update().get(user=user)
+        changed = us.subscription_id != self.id
+        activated = not us.active
+        if changed or activated:
+            us.subscription, us.active = self, True
+            us.save()
+        if changed:
+            signals.subscribed.send(us)
+        if activated:
+            signals.activated.send(us)
+        return us
+
+    def bulk_subscribe(self, users, batch_size=1000):
+        """Subscribe `users' (sequence of ids or User objects) to this
+        plan, `batch_size' users per database transaction.  Return
+        (created, changed, activated) counts.
+
+        Every chunk takes one SELECT ... FOR UPDATE, one bulk_create, at
+        most two UPDATEs and one bulk insert of Transaction rows.  No
+        signals other than transactions_recorded are sent.  If a
+        concurrent call creates a subscription for one of the users,
+        the chunk fails with IntegrityError and is rolled back; calling
+        again is safe."""
+        from subscription.usercache import user_subscriptions
+        expires = self.initial_expires()
+        user_ids = iter([ getattr(user, 'pk', user) for user in users ])
+        created = changed = activated = 0
+        while True:
+            chunk = list(itertools.islice(user_ids, batch_size))
+            if not chunk:
+                break
+            chunk = sorted(set(chunk))   # same lock order in concurrent calls
+            with journal.atomic():
+                existing = dict(
+                    (user_id, (subscription_id, active))
+                    for user_id, subscription_id, active in
+                    UserSubscription.objects.select_for_update().filter(user__in=chunk)
+                    .values_list('user', 'subscription', 'active'))
+                new = [ user_id for user_id in chunk if user_id not in existing ]
+                moved = [ user_id for user_id, (subscription_id, active) in existing.items()
+                          if subscription_id != self.id ]
+                inactive = [ user_id for user_id, (subscription_id, active) in existing.items()
+                             if not active ]
+                UserSubscription.objects.bulk_create([
+                        UserSubscription(user_id=user_id, subscription=self, expires=expires)
+                        for user_id in new ])
+                if moved:
+                    UserSubscription.objects.filter(user__in=moved) \
+                        .update(subscription=self, active=True)
+                if inactive:
+                    UserSubscription.objects.filter(user__in=inactive, active=False) \
+                        .update(active=True)
+                journal.extend(
+                    [ Transaction(user_id=user_id, subscription=self,
+                                  event=Transaction.EVENT_SUBSCRIBED)
+                      for user_id in new + moved ] +
+                    [ Transaction(user_id=user_id, subscription=self,
+                                  event=Transaction.EVENT_ACTIVATED)
+                      for user_id in inactive ])
+            user_subscriptions.invalidate_many(new + moved + inactive)
+            created += len(new)
+            changed += len(moved)
+            activated += len(inactive)
+        return created, changed, activated
+
+    def migrate_users(self, plan, recompute_expires=False, batch_size=1000, start_after=0):
+        """Move all users subscribed to this plan to Subscription `plan',
+        `batch_size' subscriptions per database transaction, in order of
+        UserSubscription id.  Generator yielding (last_id, count) after
+        every committed chunk; pass `last_id' as `start_after' to resume.
+
+        Every chunk costs one locked read, one UPDATE and one bulk insert
+        of EVENT_SUBSCRIBED Transaction rows.  If `recompute_expires' is
+        true, `expires' is reset as for a new subscription to `plan'.
+        No signals other than transactions_recorded are sent."""
+        from subscription.usercache import user_subscriptions
+        changes = { 'subscription': plan }
+        if recompute_expires:
+            changes['expires'] = plan.initial_expires()
+        last_id = start_after
+        while True:
+            with journal.atomic():
+                chunk = list(self.user_subscriptions.select_for_update()
+                             .filter(pk__gt=last_id).order_by('pk')
+                             .values_list('pk', 'user')[:batch_size])
+                if not chunk:
+                    break
+                UserSubscription.objects.filter(pk__in=[ pk for pk, user_id in chunk ]) \
+                    .update(**changes)
+                journal.extend([ Transaction(user_id=user_id, subscription=plan,
+                                             event=Transaction.EVENT_SUBSCRIBED)
+                                 for pk, user_id in chunk ])
+            user_subscriptions.invalidate_many([ user_id for pk, user_id in chunk ])
+            last_id = chunk[-1][0]
+            yield last_id, len(chunk)
+
 SUBSCRIPTION_GRACE_PERIOD = getattr(settings, 'SUBSCRIPTION_GRACE_PERIOD', 2)
 
+class UserSubscriptionManager(models.Manager):
+    
+    def expired(self, today=None):
+        """Return subscriptions with more than SUBSCRIPTION_GRACE_PERIOD
+        days after expiration date, same as UserSubscription.expired()."""
+        if today is None:
+            today = datetime.date.today()
+        return self.filter(expires__lt=today - datetime.timedelta(SUBSCRIPTION_GRACE_PERIOD))
+
 class UserSubscription(models.Model):
     user = models.OneToOneField(auth.models.User, related_name="subscription")
     subscription = models.ForeignKey(Subscription, related_name="user_subscriptions")
     expires = models.DateField(_('expires'))
     active = models.BooleanField(default=True)
 
+    objects = UserSubscriptionManager()
+
     class Meta:
         unique_together = ( ('user','subscription'), )
         
     def __init__(self, *args, **kwargs):
         super(UserSubscription, self).__init__(*args, **kwargs)
         
-        if self.expires is None: 
-            period, unit = (self.subscription.trial_period, 
-                            self.subscription.trial_unit) if self.subscription.trial_period \
-                            else (self.subscription.recurrence_period,
-                                self.subscription.recurrence_unit)
-            
-            self.expires = utils.extend_date_by(datetime.datetime.now(), period, unit)
+        if self.expires is None and self.subscription_id is not None: 
+            self.expires = self.subscription.initial_expires()
     
     def expired(self):
         """Returns true if there is more than SUBSCRIPTION_GRACE_PERIOD
@@ -195,6 +490,7 @@ class UserSubscription(models.Model):
             self.expires + grace_timedelta < datetime.date.today() )
     expired.boolean = True
     
+    @timed('usersubscription.extend')
     def extend(self, timedelta=None):
         """Extend subscription by `timedelta' or by subscription's
         recurrence period."""
@@ -208,12 +504,14 @@ class UserSubscription(models.Model):
         self.save()
         signals.recured.send(self)
         
+    @timed('usersubscription.activate')
     def activate(self):
         if not self.active:
             self.active = True
             self.save()
             signals.activated.send(self)
     
+    @timed('usersubscription.cancel')
     def cancel(self):
         if self.active:
             self.active = False
@@ -226,17 +524,19 @@ class UserSubscription(models.Model):
         If subscription change is possible, returns false value; if
         change is impossible, returns a list of reasons to display.
 
-        Checks are performed by sending
-        subscription.signals.change_check with sender being
-        UserSubscription object, and additional parameter
+        Rules registered with subscription.policy.policy, which depend
+        only on current and new plan, are looked up in precomputed
+        matrix.  Then subscription.signals.change_check is sent with
+        sender being UserSubscription object, and additional parameter
         `subscription' being new Subscription instance.  Signal
         listeners should return None if change is possible, or a
         reason to display.
         """
-        if self.subscription == subscription:
+        from subscription.policy import policy
+        if self.subscription_id == subscription.id:
             if not self.active: return None # allow resubscribing
             return [ _(u'This is your current subscription.') ]
-        return [
+        return policy.reasons(self.subscription_id, subscription) + [
             res[1]
             for res in signals.change_check.send(
                 self, subscription=subscription)
@@ -2,11 +2,15 @@
 """ Handle PayPal signals """
 
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 
 import paypal.standard.ipn.signals
 
+from subscription.instrumentation import timed
+from subscription.ipnqueue import queued
 from subscription.signals import paid
-from subscription.models import Subscription
+from subscription.models import Subscription, UserSubscription, ProcessedPayment
+from subscription.journal import journal
 
 def get_subscription(payment):
     try:
@@ -21,34 +25,80 @@ def get_user(payment):
         pass
 
 
+@queued
+@timed('paypal.subscription_signup')
 def handle_subscription_signup(sender, **kwargs):
     subscription = get_subscription(sender)
     if subscription is not None:
-        subscription.subscribe(get_user(sender))
+        with journal.atomic():
+            subscription.subscribe(get_user(sender))
 paypal.standard.ipn.signals.subscription_signup.connect(handle_subscription_signup)
 paypal.standard.ipn.signals.subscription_modify.connect(handle_subscription_signup)
 
 
+def get_user_id(payment):
+    try:
+        return int(payment.custom)
+    except ValueError:
+        pass
+
+def claim_payment(payment):
+    """Mark `payment' as processed.  Returns False if PayPal transaction
+    with the same id was already processed.
+
+    Must be called inside a database transaction."""
+    if not payment.txn_id:
+        return True
+    sid = transaction.savepoint()
+    try:
+        ProcessedPayment.objects.create(txn_id=payment.txn_id, ipn=payment)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return False
+    transaction.savepoint_commit(sid)
+    return True
+
+
+@queued
+@timed('paypal.payment_was_successful')
 def handle_payment_was_successful(sender, **kwargs):
-    user = get_user(sender)
-    if user is not None:
-        us = user.subscription
+    user_id = get_user_id(sender)
+    if user_id is None:
+        return
+    with journal.atomic():
+        if not claim_payment(sender):
+            return
+        try:
+            us = UserSubscription.objects.select_for_update().select_related('subscription') \
+                                         .get(user__id=user_id)
+        except UserSubscription.DoesNotExist:
+            if not User.objects.filter(id=user_id).exists():
+                return
+            raise
         paid.send(us, payment=sender)
-        us.extend()
+        # each change is saved before its signal: listeners writing
+        # right away (e.g. the scheduler) read the row back
         us.activate()
+        us.extend()
 paypal.standard.ipn.signals.payment_was_successful.connect(handle_payment_was_successful)
 paypal.standard.ipn.signals.recurring_payment.connect(handle_payment_was_successful)
 
 
+@queued
+@timed('paypal.subscription_cancel')
 def handle_subscription_cancel(sender, **kwargs):
     user = get_user(sender)
     if user is not None:
-        user.subscription.cancel()
+        with journal.batch():
+            user.subscription.cancel()
 paypal.standard.ipn.signals.subscription_cancel.connect(handle_subscription_cancel)
 
 
+@queued
+@timed('paypal.subscription_eot')
 def handle_subscription_eot(sender, **kwargs):
     user = get_user(sender)
     if user is not None:
-        user.subscription.delete()
+        with journal.batch():
+            user.subscription.delete()
 paypal.standard.ipn.signals.subscription_eot.connect(handle_subscription_eot)
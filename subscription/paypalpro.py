@@ -0,0 +1,79 @@
+### -*- coding: utf-8 -*- ####################################################
+""" django-paypal Website Payments Pro making NVP calls over pooled
+keep-alive connections.
+
+Imported on first Pro checkout: paypal.pro.helpers needs PAYPAL_WPP_*
+settings at import time. """
+
+from django.conf import settings
+from django.http import HttpResponseRedirect
+from django.utils.http import urlencode
+
+from paypal.pro import helpers
+from paypal.pro.exceptions import PayPalFailure
+from paypal.pro.forms import PaymentForm
+from paypal.pro.views import PayPalPro
+
+from subscription.providers import connection_pool
+
+def endpoint():
+    """NVP API URL: SUBSCRIPTION_PAYPAL_NVP_ENDPOINT setting, or PayPal's
+    sandbox or live endpoint depending on PAYPAL_TEST."""
+    return getattr(settings, 'SUBSCRIPTION_PAYPAL_NVP_ENDPOINT',
+                   helpers.TEST and helpers.SANDBOX_ENDPOINT or helpers.ENDPOINT)
+
+class PooledPayPalWPP(helpers.PayPalWPP):
+    def __init__(self, request, params=helpers.BASE_PARAMS):
+        super(PooledPayPalWPP, self).__init__(request, params)
+        self.endpoint = endpoint()
+
+    def _request(self, data):
+        return connection_pool(self.endpoint).post(data)
+
+class PooledPaymentForm(PaymentForm):
+    def process(self, request, item):
+        """Process a PayPal direct payment."""
+        wpp = PooledPayPalWPP(request)
+        params = self.cleaned_data
+        params['creditcardtype'] = self.fields['acct'].card_type
+        params['expdate'] = self.cleaned_data['expdate'].strftime("%m%Y")
+        params['ipaddress'] = request.META.get("REMOTE_ADDR", "")
+        params.update(item)
+        try:
+            if 'billingperiod' not in params:
+                wpp.doDirectPayment(params)
+            else:
+                wpp.createRecurringPaymentsProfile(params, direct=True)
+        except PayPalFailure:
+            return False
+        return True
+
+class PooledPayPalPro(PayPalPro):
+    """PayPalPro whose express checkout steps use PooledPayPalWPP.
+    Still one instance per request: it keeps request's item and
+    context."""
+    def redirect_to_express(self):
+        wpp = PooledPayPalWPP(self.request)
+        try:
+            nvp_obj = wpp.setExpressCheckout(self.item)
+        except PayPalFailure:
+            self.context['errors'] = self.errors['paypal']
+            return self.render_payment_form()
+        pp_params = dict(token=nvp_obj.token, AMT=self.item['amt'],
+                         RETURNURL=self.item['returnurl'],
+                         CANCELURL=self.item['cancelurl'])
+        return HttpResponseRedirect(self.get_endpoint() % urlencode(pp_params))
+
+    def validate_confirm_form(self):
+        wpp = PooledPayPalWPP(self.request)
+        self.item.update(token=self.request.POST['token'],
+                         payerid=self.request.POST['PayerID'])
+        try:
+            if self.is_recurring():
+                wpp.createRecurringPaymentsProfile(self.item)
+            else:
+                wpp.doExpressCheckoutPayment(self.item)
+        except PayPalFailure:
+            self.context['errors'] = self.errors['processing']
+            return self.render_payment_form()
+        return HttpResponseRedirect(self.success_url)
@@ -0,0 +1,72 @@
+### -*- coding: utf-8 -*- ####################################################
+""" subscription change rules depending only on current and new plan """
+
+import threading
+
+from subscription.catalog import catalog
+from subscription.models import Subscription
+
+class ChangePolicy(object):
+    """
+        Registry of change rules.  A rule is a function called with
+        current and new Subscription (plans from the catalog, which must
+        not be modified), returning None if change is allowed or a
+        reason to display (preferably a lazy translation).
+
+        Rules are evaluated once for every pair of plans; the result is
+        kept until a plan is saved or deleted, or a rule is registered.
+        Checks that need the user belong in `change_check' signal
+        listeners.
+    """
+    def __init__(self):
+        self.rules = []
+        self._matrix = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def register(self, rule):
+        """Add `rule'; may be used as a decorator."""
+        with self._lock:
+            self.rules.append(rule)
+            self._matrix = None
+        return rule
+
+    def unregister(self, rule):
+        with self._lock:
+            self.rules.remove(rule)
+            self._matrix = None
+
+    def evaluate(self, from_plan, to_plan):
+        """Return list of reasons from all rules for changing `from_plan'
+        to `to_plan'."""
+        return [ reason for reason in
+                 [ rule(from_plan, to_plan) for rule in self.rules ]
+                 if reason ]
+
+    def matrix(self):
+        """Return dictionary mapping (from_id, to_id) pairs of different
+        plans to tuples of reasons."""
+        matrix = self._matrix
+        version = catalog.current_version()
+        if matrix is None or self._version != version:
+            plans = catalog.plans()
+            matrix = dict([ ((from_plan.id, to_plan.id), tuple(self.evaluate(from_plan, to_plan)))
+                            for from_plan in plans for to_plan in plans
+                            if from_plan.id != to_plan.id ])
+            with self._lock:
+                self._matrix, self._version = matrix, version
+        return matrix
+
+    def reasons(self, from_id, to_plan):
+        """Return list of reasons for changing plan with id `from_id' to
+        Subscription `to_plan'."""
+        if not self.rules:
+            return []
+        try:
+            return list(self.matrix()[from_id, to_plan.id])
+        except KeyError:
+            # plans not (yet) in catalog
+            from_plan = catalog.get(from_id) or Subscription.objects.get(id=from_id)
+            return self.evaluate(from_plan, to_plan)
+
+policy = ChangePolicy()
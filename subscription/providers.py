@@ -1,5 +1,12 @@
+import httplib
+import select
+import socket
 import sys
+import threading
+import urlparse
+
 from django.conf import settings
+from django.utils.importlib import import_module
 
 """
 PROPOSALS (only for payment methods which happens behind the scene)
@@ -8,66 +15,218 @@ PROPOSALS (only for payment methods which happens behind the scene)
 2. According to user selected payment method, build object (Factory DP)
 3. Call proceed() function.
 
-TODO
-1. Create mappings <payment_method> => <payment_class> to make views more clear, i.e.:
-
-in urls.py
- (r'^(?P<object_id>\d+)/(?P<payment_method>(standard|pro|authorize))$', 'subscription_detail', {}, 'subscription_detail'),
+Payment methods are looked up by name in PAYMENT_METHODS_MAPPINGS
+setting, mapping <payment_method> => <payment_class>; class is a name
+of class in this module or a dotted path, imported on first use:
 
 in settings.py:
 PAYMENT_METHODS_MAPPINGS = {
     'pro': 'WebsitePaymentsPro', #subscription.providers.WebsitePaymentsPro
-    'authorize': 'Authorize', #subscription.providers.Authorize
+    'authorize': 'myproject.payments.Authorize',
     etc..
 }
 
-in.views.py:
+in views.py:
 
 def subscription_details(request, object_id, payment_method="pro"):
-    from subscription.providers import PaymentMethodFactory, pick_class    
-    payment_object = PaymentMethodFactory(pick_class(payment_method), ...)    
+    from subscription.providers import PaymentMethodFactory, pick_class
+    payment_object = PaymentMethodFactory.factory(pick_class(payment_method), ...)
     payment_object.proceed(...)
 
 """
 
-def pick_class(payment_method, default_method):
+DEFAULT_MAPPINGS = {
+    'pro': 'WebsitePaymentsPro',
+    }
+
+def mappings():
+    return getattr(settings, 'PAYMENT_METHODS_MAPPINGS', DEFAULT_MAPPINGS)
+
+def pick_class(payment_method, default_method=None):
+    """Return payment class name (or path) mapped to `payment_method',
+    or `default_method'."""
+    return mappings().get(payment_method, default_method)
+
+
+class ProviderRegistry(object):
+    """Payment method classes by class name or dotted path, imported on
+    first use and kept for the life of the process."""
+    def __init__(self):
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        try:
+            return self._classes[name]
+        except KeyError:
+            pass
+        if '.' in name:
+            module, attr = name.rsplit('.', 1)
+            cls = getattr(import_module(module), attr)
+        else:
+            cls = getattr(sys.modules[__name__], name)
+        with self._lock:
+            self._classes[name] = cls
+        return cls
+
+    def get(self, payment_method):
+        """Return class mapped to `payment_method' in
+        PAYMENT_METHODS_MAPPINGS; raise KeyError if there is none."""
+        return self.resolve(mappings()[payment_method])
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+
+registry = ProviderRegistry()
+
+
+class ConnectionPool(object):
     """
-    return settings.PAYMENT_METHODS_MAPPINGS.get(payment_method, default_method)    
+        Keep-alive HTTP(S) connections to one URL, shared between
+        threads.  At most `size' idle connections are kept, and those
+        closed by server meanwhile are dropped before use; a request is
+        repeated once on a new connection only if sending it on a kept
+        one failed.
     """
-    pass
+    def __init__(self, url, size=4, timeout=30):
+        parts = urlparse.urlsplit(url)
+        self.connection_class = parts.scheme == 'https' and httplib.HTTPSConnection \
+            or httplib.HTTPConnection
+        self.host = parts.netloc
+        self.path = (parts.path or '/') + (parts.query and '?' + parts.query or '')
+        self.size = size
+        self.timeout = timeout
+        self.connections_made = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connection(self, reuse=True):
+        while reuse:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection = self._idle.pop()
+            if not _dropped(connection):
+                return connection, True
+            connection.close()
+        with self._lock:
+            self.connections_made += 1
+        return self.connection_class(self.host, timeout=self.timeout), False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def _send(self, connection, reused, body, content_type):
+        """Send request and return response, or None if sending it on
+        kept-alive `connection' failed.  Timeouts and failures after the
+        request was sent (including connection closed without response)
+        are raised: NVP calls (e.g. DoDirectPayment) must not be
+        repeated."""
+        try:
+            connection.request('POST', self.path, body, {'Content-Type': content_type})
+        except socket.timeout:
+            raise
+        except (httplib.HTTPException, socket.error):
+            if reused:
+                return None
+            raise
+        return connection.getresponse()
+
+    def post(self, body, content_type='application/x-www-form-urlencoded'):
+        """POST `body' to pool's URL; return response body.  Raise
+        httplib.HTTPException if response status is not 200."""
+        connection, reused = self._connection()
+        try:
+            response = self._send(connection, reused, body, content_type)
+            if response is None:
+                connection.close()
+                connection, reused = self._connection(reuse=False)
+                response = self._send(connection, reused, body, content_type)
+            data = response.read()
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        if response.status != 200:
+            raise httplib.HTTPException('%s returned HTTP %d' % (self.host, response.status))
+        return data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+def _dropped(connection):
+    """Return true if idle kept-alive `connection' is closed: it has
+    nothing to read unless server closed it."""
+    if connection.sock is None:
+        return True
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (select.error, socket.error):
+        return True
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def connection_pool(url):
+    """Return process-wide ConnectionPool for `url', of
+    SUBSCRIPTION_CONNECTION_POOL_SIZE connections (default 4)."""
+    try:
+        return _pools[url]
+    except KeyError:
+        pass
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = ConnectionPool(
+                url, getattr(settings, 'SUBSCRIPTION_CONNECTION_POOL_SIZE', 4))
+        return _pools[url]
 
 
 class BasePaymentMethod(object):
     """This class represents the abstract base class for new payment methods"""
     def __init__(self):
         self.name = None
-        
+
     def proceed(self):
         """Runs payment process"""
         pass
-        
+
     def get_name(self):
         """Returns full name of payment method"""
-        return self.name    
+        return self.name
 
 
 class PaymentMethodFactory(object):
     """Implementation of Factory Design Pattern"""
     @staticmethod
     def factory(payment_method, **kwargs):
-        """ Factory method"""
-        cls = getattr(sys.modules[__name__], payment_method)
+        """ Factory method; `payment_method' is a class name in this
+        module or a dotted path."""
+        cls = registry.resolve(payment_method)
         return cls(**kwargs)
-    
+
 
 class WebsitePaymentsPro(BasePaymentMethod):
-    """Wrapper around django-paypal's PayPalPro"""
+    """Wrapper around django-paypal's PayPalPro, making NVP calls over
+    pooled connections (see subscription.paypalpro)"""
     def __init__(self, **kwargs):
         self.name = 'Website Payments Pro'
         self.data = kwargs.get('data')
         self.request = kwargs.get('request')
-        
+
     def proceed(self):
-        from paypal.pro.views import PayPalPro
-        ppp = PayPalPro(**self.data)
-        return ppp(self.request)
\ No newline at end of file
+        from subscription.paypalpro import PooledPayPalPro, PooledPaymentForm
+        data = dict(self.data)
+        data.setdefault('payment_form_cls', PooledPaymentForm)
+        ppp = PooledPayPalPro(**data)
+        return ppp(self.request)
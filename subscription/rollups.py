@@ -0,0 +1,96 @@
+### -*- coding: utf-8 -*- ####################################################
+""" daily per-plan transaction counts and amounts """
+
+import datetime
+from decimal import Decimal
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count, F, Sum
+
+from subscription import signals
+from subscription.models import ArchivedTransaction, DailyRollup, Transaction
+
+def _add(date, subscription_id, event, count, amount):
+    """Add `count' and `amount' to rollup row, creating it if needed.
+
+    Must be called inside a database transaction."""
+    rows = DailyRollup.objects.filter(date=date, subscription_key=subscription_id or 0,
+                                      event=event)
+    if rows.update(count=F('count') + count, amount=F('amount') + amount):
+        return
+    sid = transaction.savepoint()
+    try:
+        DailyRollup.objects.create(date=date, subscription_id=subscription_id,
+                                   subscription_key=subscription_id or 0, event=event,
+                                   count=count, amount=amount)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        rows.update(count=F('count') + count, amount=F('amount') + amount)
+    else:
+        transaction.savepoint_commit(sid)
+
+def record(transactions):
+    """Add Transaction objects in `transactions' to rollups, one row
+    update per (day, subscription, event)."""
+    amount_field = Transaction._meta.get_field('amount')
+    totals = {}
+    for t in transactions:
+        day = t.timestamp.date() if t.timestamp else datetime.date.today()
+        count, amount = totals.get((day, t.subscription_id, t.event), (0, Decimal(0)))
+        totals[day, t.subscription_id, t.event] = \
+            count + 1, amount + (amount_field.to_python(t.amount) or 0)
+    for (day, subscription_id, event), (count, amount) in sorted(totals.items()):
+        _add(day, subscription_id, event, count, amount)
+
+def transactions_recorded(transactions, **kwargs):
+    record([t for t in transactions if isinstance(t, Transaction)])
+signals.transactions_recorded.connect(transactions_recorded)
+
+
+def _as_date(value):
+    # date_trunc_sql gives datetime or, on SQLite, a string
+    if isinstance(value, basestring):
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+def aggregate(start, end):
+    """Return list of unsaved DailyRollup objects computed from
+    transactions (including archived ones) on days from `start' up to,
+    but excluding, `end'."""
+    totals = {}
+    for model in (Transaction, ArchivedTransaction):
+        column = '%s.%s' % (connection.ops.quote_name(model._meta.db_table),
+                            connection.ops.quote_name('timestamp'))
+        rows = model.objects.filter(timestamp__gte=start, timestamp__lt=end) \
+            .extra(select={'day': connection.ops.date_trunc_sql('day', column)}) \
+            .values('day', 'subscription', 'event') \
+            .annotate(Count('id'), Sum('amount')).order_by()
+        for row in rows:
+            key = _as_date(row['day']), row['subscription'], row['event']
+            count, amount = totals.get(key, (0, Decimal(0)))
+            totals[key] = count + row['id__count'], amount + (row['amount__sum'] or 0)
+    return [ DailyRollup(date=day, subscription_id=subscription_id,
+                         subscription_key=subscription_id or 0, event=event,
+                         count=count, amount=amount)
+             for (day, subscription_id, event), (count, amount) in sorted(totals.items()) ]
+
+def rebuild(start, end):
+    """Replace rollups for days from `start' up to, but excluding,
+    `end' with ones computed from transactions."""
+    with transaction.commit_on_success():
+        DailyRollup.objects.filter(date__gte=start, date__lt=end).delete()
+        DailyRollup.objects.bulk_create(aggregate(start, end))
+
+def totals(start=None, end=None):
+    """Return dictionary mapping (subscription_id, event) to (count,
+    amount) summed over days from `start' up to, but excluding, `end'."""
+    rows = DailyRollup.objects.all()
+    if start is not None:
+        rows = rows.filter(date__gte=start)
+    if end is not None:
+        rows = rows.filter(date__lt=end)
+    return dict(((row['subscription'], row['event']), (row['count__sum'], row['amount__sum']))
+                for row in rows.values('subscription', 'event')
+                               .annotate(Sum('count'), Sum('amount')).order_by())
@@ -0,0 +1,116 @@
+### -*- coding: utf-8 -*- ####################################################
+""" schedule of upcoming expirations and trial ends """
+
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from subscription import signals
+from subscription.journal import journal
+from subscription.models import SUBSCRIPTION_GRACE_PERIOD, ScheduledEvent, Transaction, \
+    UserSubscription
+
+SCHEDULE_EVENTS = (Transaction.EVENT_SUBSCRIBED, Transaction.EVENT_ACTIVATED,
+                   Transaction.EVENT_RECURED, Transaction.EVENT_CANCELLED,
+                   Transaction.EVENT_REMOVED)
+
+def reminder_days():
+    return getattr(settings, 'SUBSCRIPTION_REMINDER_DAYS', 7)
+
+def events(user_id, subscription_id, expires, active, trial=False, today=None):
+    """Return list of unsaved ScheduledEvent objects for subscription
+    expiring on `expires'.
+
+    Active subscription gets a reminder SUBSCRIPTION_REMINDER_DAYS days
+    before expiry (unless that is past), trial end (if `trial') or
+    expiry, and grace period end; cancelled one only grace period end."""
+    if expires is None:
+        return []
+    grace_end = expires + datetime.timedelta(SUBSCRIPTION_GRACE_PERIOD)
+    due = [ (grace_end, ScheduledEvent.KIND_GRACE_END) ]
+    if active:
+        due.append((expires, trial and ScheduledEvent.KIND_TRIAL_END
+                                or ScheduledEvent.KIND_EXPIRY))
+        days = reminder_days()
+        reminder = expires - datetime.timedelta(days)
+        if days and reminder >= (today or datetime.date.today()):
+            due.append((reminder, ScheduledEvent.KIND_REMINDER))
+    return [ ScheduledEvent(user_id=user_id, subscription_id=subscription_id,
+                            due=date, kind=kind)
+             for date, kind in sorted(due) ]
+
+def _unschedule(user_ids):
+    ScheduledEvent.objects.filter(user__in=list(user_ids)).delete()
+
+def reschedule(user_ids, trial_user_ids=()):
+    """Replace scheduled events of users in `user_ids' with ones
+    computed from their current subscriptions; users in
+    `trial_user_ids' are in trial period if their plan has one.
+
+    Must be called inside a database transaction."""
+    trial_user_ids = set(trial_user_ids)
+    new = []
+    for user_id, subscription_id, expires, active, trial_period in \
+            UserSubscription.objects.filter(user__in=user_ids).values_list(
+                'user', 'subscription', 'expires', 'active', 'subscription__trial_period'):
+        new.extend(events(user_id, subscription_id, expires, active,
+                          trial_period and user_id in trial_user_ids))
+    sid = transaction.savepoint()
+    try:
+        _unschedule(user_ids)
+        ScheduledEvent.objects.bulk_create(new)
+    except IntegrityError:
+        # concurrent reschedule of the same user
+        transaction.savepoint_rollback(sid)
+        _unschedule(user_ids)
+        ScheduledEvent.objects.bulk_create(new)
+    else:
+        transaction.savepoint_commit(sid)
+
+def transactions_recorded(transactions, **kwargs):
+    """Reschedule users whose subscriptions were subscribed, activated,
+    extended, cancelled or removed; one query each to read
+    subscriptions, drop old and insert new events."""
+    latest = {}
+    for t in transactions:
+        if isinstance(t, Transaction) and t.user_id is not None and t.event in SCHEDULE_EVENTS:
+            latest[t.user_id] = t.event
+    if latest:
+        reschedule(latest.keys(), [ user_id for user_id, event in latest.items()
+                                    if event == Transaction.EVENT_SUBSCRIBED ])
+signals.transactions_recorded.connect(transactions_recorded)
+
+
+def rebuild(batch_size=1000):
+    """Recompute events of all subscriptions, `batch_size' users per
+    database transaction; for filling the schedule initially."""
+    last_pk = 0
+    while True:
+        with transaction.commit_on_success():
+            chunk = list(UserSubscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', 'user')[:batch_size])
+            if not chunk:
+                break
+            reschedule([ user_id for pk, user_id in chunk ])
+        last_pk = chunk[-1][0]
+
+def pop_due(today=None, limit=100):
+    """Remove up to `limit' events due on or before `today' (earliest
+    first) and send `event_due' signal for each, with the event as
+    sender, in one database transaction; return list of events.
+
+    If a listener raises, the transaction is rolled back and the events
+    stay scheduled."""
+    today = today or datetime.date.today()
+    with journal.atomic():
+        ids = list(ScheduledEvent.objects.select_for_update().filter(due__lte=today)
+                   .values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        due = list(ScheduledEvent.objects.select_related('user', 'subscription')
+                   .filter(id__in=ids))
+        ScheduledEvent.objects.filter(id__in=ids).delete()
+        for event in due:
+            signals.event_due.send(event)
+    return due
@@ -1,14 +1,20 @@
 ### -*- coding: utf-8 -*- ####################################################
 """ subscription signals """
-from django.dispatch import Signal
+from subscription.instrumentation import InstrumentedSignal
 
 
 # recurring subscriptions
-subscribed = Signal()
-paid = Signal(providing_args=["payment"])
-cancelled = Signal()
-activated = Signal()
-recured = Signal()
+subscribed = InstrumentedSignal('subscribed')
+paid = InstrumentedSignal('paid', providing_args=["payment"])
+cancelled = InstrumentedSignal('cancelled')
+activated = InstrumentedSignal('activated')
+recured = InstrumentedSignal('recured')
 
 # upgrade/downgrade possibility check
-change_check = Signal()
+change_check = InstrumentedSignal('change_check')
+
+# Transaction (and other journal) rows written to database
+transactions_recorded = InstrumentedSignal('transactions_recorded', providing_args=["transactions"])
+
+# ScheduledEvent (sender) popped from schedule by subscription.scheduler
+event_due = InstrumentedSignal('event_due')
@@ -0,0 +1 @@
+CREATE INDEX subscription_archivedtransaction_history ON subscription_archivedtransaction (user_id, event, timestamp, id);
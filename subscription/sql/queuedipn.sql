@@ -0,0 +1,2 @@
+CREATE INDEX subscription_queuedipn_due ON subscription_queuedipn (dead, next_attempt, id);
+CREATE INDEX subscription_queuedipn_user ON subscription_queuedipn (user_id, id);
@@ -0,0 +1 @@
+CREATE INDEX subscription_scheduledevent_due ON subscription_scheduledevent (due, id);
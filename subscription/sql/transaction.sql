@@ -0,0 +1 @@
+CREATE INDEX subscription_transaction_history ON subscription_transaction (user_id, event, timestamp, id);
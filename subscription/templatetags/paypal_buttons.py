@@ -9,8 +9,8 @@ from paypal.standard.conf import TEST
 
 register = template.Library()
 
-from subscription.models import UserSubscription
-from subscription.forms import _paypal_form
+from subscription.usercache import user_subscriptions
+from subscription.forms import paypal_button as _paypal_button, paypal_form_base
 
 # http://paypaldeveloper.com/pdn/board/message?board.id=basicpayments&message.id=621
 if settings.PAYPAL_TEST:
@@ -21,25 +21,50 @@ else:
                     % urllib.quote(settings.PAYPAL_RECEIVER_EMAIL)
 
 
-@register.inclusion_tag("paypal/shortcut.html", takes_context=False)
-def paypal_shortcut(user, subscription):
-    try:
-        us = user.subscription
-    except UserSubscription.DoesNotExist:
+def _user_subscription(user):
+    return user_subscriptions.get(user)
+
+def _button(user, us, subscription, base=None):
+    "Return paypal/shortcut.html context for `user' with subscription `us'."
+    if us is None:
         change_denied_reasons = None
-        us = None
     else:
         change_denied_reasons = us.try_change(subscription)
 
     if change_denied_reasons:
-        form = None
+        button = None
     else:
-        form = _paypal_form(subscription, user,
-                    upgrade_subscription=(us is not None) and (us.subscription != subscription))
+        button = _paypal_button(subscription, user,
+                    upgrade_subscription=(us is not None) and (us.subscription != subscription),
+                    sandbox=TEST, base=base)
     
-    return {'form': form, 'change_denied_reasons': change_denied_reasons,
+    return {'button': button, 'change_denied_reasons': change_denied_reasons,
             'test': TEST,
             'subscription': subscription,
             'current': us and (subscription == us.subscription) and us, 'cancel_url': cancel_url,
             'image_url': "https://www.paypal.com/en_US/i/btn/btn_unsubscribe_LG.gif"} 
-    
\ No newline at end of file
+
+
+@register.inclusion_tag("paypal/shortcut.html", takes_context=False)
+def paypal_shortcut(user, subscription):
+    return _button(user, _user_subscription(user), subscription)
+
+
+@register.assignment_tag
+def paypal_buttons(user, subscriptions):
+    """Compute paypal_shortcut contexts for all `subscriptions' at once.
+
+    User's subscription, site and PayPal URLs are looked up only once:
+
+    {% paypal_buttons user object_list as buttons %}
+    {% for button in buttons %}{% paypal_button button %}{% endfor %}
+    """
+    us = _user_subscription(user)
+    base = paypal_form_base()
+    return [ _button(user, us, subscription, base) for subscription in subscriptions ]
+
+
+@register.inclusion_tag("paypal/shortcut.html", takes_context=False)
+def paypal_button(button):
+    "Render one of buttons computed by paypal_buttons tag."
+    return button
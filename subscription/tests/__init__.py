@@ -3,6 +3,24 @@
 #from test_client import ClientTest
 from test_model import ModelTest
 from test_middleware import MiddlewareTest
+from test_backends import BackendTest
+from test_commands import CommandsTest
+from test_journal import JournalTest
+from test_paypalhandlers import PayPalHandlersTest
+from test_utils import UtilsTest
+from test_catalog import CatalogTest
+from test_templatetags import TemplateTagsTest
+from test_forms import FormsTest
+from test_invoices import InvoicesTest
+from test_rollups import RollupsTest
+from test_usercache import UserCacheTest
+from test_entitlements import EntitlementsTest
+from test_policy import PolicyTest
+from test_instrumentation import InstrumentationTest
+from test_scheduler import SchedulerTest
+from test_ipnqueue import IPNQueueTest
+from test_providers import ProvidersTest
 #from test_admin import AdminTest
+from test_admin import ChangeListTest, InlineTest
 
 #from paypal.standard.ipn.tests.test_ipn import IPNTest
@@ -2,10 +2,20 @@
 
 from datetime import datetime, date, timedelta
 
+from django.contrib.admin.sites import site
+from django.contrib.admin.templatetags.admin_list import results
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
 from django.core.urlresolvers import reverse
 
+from paypal.standard.ipn.models import PayPalIPN
+
+from subscription.admin import TransactionAdmin, UserSubscriptionAdmin, TransactionInline
+from subscription.models import Subscription, Transaction, UserSubscription
+
 class AdminTest(TransactionTestCase):
     fixtures = ['test_subscription.json']
     
@@ -74,4 +84,94 @@ class AdminTest(TransactionTestCase):
 #        self.assertEqual(self.user.get_and_delete_messages(), 
 #                [u'1 plumb line was successfully intermited or unintermited.'])
 #        self.assertRedirects(response, change_list_url)
-#===============================================================================
\ No newline at end of file
+#===============================================================================
+
+class ChangeListTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    admins = {Transaction: TransactionAdmin, UserSubscription: UserSubscriptionAdmin}
+    
+    def changelist(self, model, **params):
+        model_admin = self.admins[model](model, site)
+        request = RequestFactory().get('/', params)
+        request.user = User(is_superuser=True)
+        ChangeList = model_admin.get_changelist(request)
+        cl = ChangeList(request, model, model_admin.list_display, 
+                        model_admin.list_display_links, model_admin.list_filter,
+                        model_admin.date_hierarchy, model_admin.search_fields, 
+                        model_admin.list_select_related, model_admin.list_per_page,
+                        model_admin.list_max_show_all, model_admin.list_editable, 
+                        model_admin)
+        cl.formset = None
+        return cl
+    
+    def queries(self, model, **params):
+        """ number of queries needed to build and render change list """
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            list(results(self.changelist(model, **params)))
+            return len(connection.queries) - start
+        finally:
+            connection.use_debug_cursor = None
+    
+    def add_transactions(self, n):
+        ipn = PayPalIPN.objects.create(txn_id='51403485VH153354B', ipaddress='127.0.0.1')
+        for i in range(n):
+            Transaction.objects.create(user_id=2, subscription_id=2, ipn=ipn,
+                                       event=Transaction.EVENT_PAYMENT, amount=17)
+            Transaction.objects.create(event=Transaction.EVENT_PAYMENT)
+    
+    def test_transaction_changelist(self):
+        """ number of queries does not depend on number of rows """
+        self.add_transactions(2)
+        queries = self.queries(Transaction)
+        self.add_transactions(20)
+        self.assertEqual(self.queries(Transaction), queries)
+        self.assertEqual(self.queries(Transaction, q='gold_user'), queries + 1)
+        
+        self.assertEqual(self.changelist(Transaction, q='51403485VH153354B').result_count, 22)
+    
+    def test_usersubscription_changelist(self):
+        queries = self.queries(UserSubscription)
+        UserSubscription.objects.create(user_id=1, subscription_id=2, expires=date.today())
+        self.assertEqual(self.queries(UserSubscription), queries)
+
+
+class InlineTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        cache.clear()
+        self.gold = Subscription.objects.get(id=2)
+        self.ids = [Transaction.objects.create(user_id=2, subscription=self.gold, event=2).id
+                    for i in range(15)]
+        self.inline = TransactionInline(Subscription, site)
+        self.request = RequestFactory().get('/')
+        self.request.user = User(is_superuser=True)
+    
+    def test_recent(self):
+        """ only recent transactions are shown, total count is cached """
+        FormSet = self.inline.get_formset(self.request, self.gold)
+        formset = FormSet(instance=self.gold, prefix='transactions',
+                          queryset=self.inline.queryset(self.request))
+        self.assertEqual([form.instance.id for form in formset.forms], self.ids[:-11:-1])
+        total = Transaction.objects.filter(subscription=self.gold).count()
+        self.assertEqual(FormSet.total_count, total)
+        
+        Transaction.objects.create(user_id=2, subscription=self.gold, event=2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.inline.get_formset(self.request, self.gold).total_count, total)
+    
+    def test_bound(self):
+        """ posted transactions are saved even if newer ones were added """
+        FormSet = self.inline.get_formset(self.request, self.gold)
+        data = {'transactions-TOTAL_FORMS': '1', 'transactions-INITIAL_FORMS': '1',
+                'transactions-MAX_NUM_FORMS': '0', 'transactions-0-id': str(self.ids[0]),
+                'transactions-0-subscription': str(self.gold.id),
+                'transactions-0-comment': 'refunded'}
+        formset = FormSet(data, instance=self.gold, prefix='transactions',
+                          queryset=self.inline.queryset(self.request))
+        self.assertTrue(formset.is_valid())
+        formset.save()
+        self.assertEqual(Transaction.objects.get(id=self.ids[0]).comment, 'refunded')
@@ -0,0 +1,65 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase
+
+from subscription.backends import UserSubscriptionBackend, VERSION_KEY, plan_permissions
+from subscription.models import Subscription
+
+class BackendTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        plan_permissions.invalidate()
+        cache.clear()
+        self.backend = UserSubscriptionBackend()
+        self.gold_sub = Subscription.objects.get(id=2)
+        self.perm = Permission.objects.create(name="test", 
+                                    content_type=ContentType.objects.get(name="subscription"), 
+                                    codename="test")
+        self.gold_sub.permissions.add(self.perm)
+    
+    def test_plan_permissions_cached(self):
+        """ users sharing a plan share one cached permission set """
+        hits, misses = plan_permissions.hits, plan_permissions.misses
+        
+        gold_user = User.objects.get(username='gold_user')
+        self.assertEquals(self.backend.get_all_permissions(gold_user), set([u'subscription.test']))
+        self.assertEquals(plan_permissions.misses, misses + 1)
+        
+        #plan permissions come from cache, only the user's own lookups hit the database
+        gold_user = User.objects.get(username='gold_user')
+        gold_user.subscription
+        self.assertNumQueries(2, self.backend.get_all_permissions, gold_user)
+        self.assertEquals(plan_permissions.hits, hits + 1)
+    
+    def test_invalidation(self):
+        """ changing plan permissions drops cached set """
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset([u'subscription.test']))
+        
+        self.gold_sub.permissions.remove(self.perm)
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset())
+        
+        self.perm.subscription_set.add(self.gold_sub)
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset([u'subscription.test']))
+        
+        self.perm.codename = 'renamed'
+        self.perm.save()
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset([u'subscription.renamed']))
+        
+        self.perm.delete()
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset())
+    
+    def test_other_process(self):
+        """ sets dropped by another process are reloaded """
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset([u'subscription.test']))
+        self.assertNumQueries(0, plan_permissions.get, self.gold_sub.id)
+        
+        # changed by another process: no signal here, only the shared version
+        Subscription.permissions.through.objects.filter(subscription=self.gold_sub).delete()
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset([u'subscription.test']))
+        cache.set(VERSION_KEY, 'other')
+        self.assertEquals(plan_permissions.get(self.gold_sub.id), frozenset())
+        self.assertNumQueries(0, plan_permissions.get, self.gold_sub.id)
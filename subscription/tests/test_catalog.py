@@ -0,0 +1,59 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import translation
+
+from subscription.catalog import catalog
+from subscription.models import Subscription
+from subscription.usercache import VERSION_KEY
+
+class CatalogTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        catalog.invalidate()
+    
+    def test_plans(self):
+        """ warm catalog renders plans without database queries """
+        catalog.warm()
+        
+        def render(plans):
+            return [(p.name, unicode(p.get_pricing_display()), unicode(p.get_trial_display()), 
+                     unicode(p.get_recurrence_display())) for p in plans]
+        with self.assertNumQueries(0):
+            rendered = render(catalog.plans())
+        
+        self.assertEqual(rendered, render(Subscription.objects.all()))
+        self.assertEqual(catalog.get(2).name, u'Gold Membership')
+    
+    def test_language(self):
+        """ display strings are rendered for every requested language """
+        catalog.warm()
+        with translation.override('de'):
+            with self.assertNumQueries(0):
+                plans = catalog.plans()
+        self.assertTrue('de' in plans[0]._display_cache)
+    
+    def test_invalidation(self):
+        catalog.warm()
+        version = catalog.version
+        
+        gold_sub = Subscription.objects.get(id=2)
+        gold_sub.price = 5
+        gold_sub.save()
+        
+        self.assertEqual(catalog.version, version + 1)
+        self.assertEqual(catalog.get(2).get_pricing_display(), u'5.00 / 30 days')
+    
+    def test_other_process(self):
+        """ plans changed by another process are reloaded """
+        catalog.warm()
+        version = catalog.current_version()
+        
+        # changed by another process: no signal here, only the plan version
+        Subscription.objects.filter(id=2).update(price=5)
+        self.assertEqual(catalog.get(2).get_pricing_display(), u'17.00 / 30 days')
+        cache.set(VERSION_KEY, 'other')
+        self.assertEqual(catalog.get(2).get_pricing_display(), u'5.00 / 30 days')
+        self.assertEqual(catalog.current_version(), version + 1)
@@ -0,0 +1,110 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date, datetime, timedelta
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from subscription.management.commands.expire_subscriptions import Command as ExpireCommand
+from subscription.models import Subscription, UserSubscription, Transaction, \
+    ArchivedTransaction
+
+class CommandsTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        #silver_user's subscription lapsed long ago, gold_user's is still valid
+        UserSubscription.objects.filter(user__username='silver_user').update(
+                                expires=date.today() - timedelta(30))
+    
+    def test_expire_dry_run(self):
+        out = StringIO()
+        call_command('expire_subscriptions', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), '1 subscription(s) would be deactivated.\n')
+        self.assertEqual(UserSubscription.objects.filter(active=True).count(), 2)
+    
+    def test_expire_deactivate(self):
+        call_command('expire_subscriptions', batch_size=1, stdout=StringIO())
+        
+        self.assertEqual(list(UserSubscription.objects.filter(active=False)
+                              .values_list('user__username', flat=True)), [u'silver_user'])
+        self.assertEqual(Transaction.objects.filter(event=Transaction.EVENT_CANCELLED).count(), 1)
+        
+        #already deactivated subscriptions are not swept again
+        call_command('expire_subscriptions', stdout=StringIO())
+        self.assertEqual(Transaction.objects.filter(event=Transaction.EVENT_CANCELLED).count(), 1)
+    
+    def test_expire_delete(self):
+        call_command('expire_subscriptions', delete=True, stdout=StringIO())
+        
+        self.assertEqual(list(UserSubscription.objects.values_list('user__username', flat=True)),
+                         [u'gold_user'])
+        self.assertEqual(list(Transaction.objects.filter(event=Transaction.EVENT_REMOVED)
+                              .values_list('user__username', flat=True)), [u'silver_user'])
+    
+    def test_expire_renewed(self):
+        """ subscription renewed after it was read is not swept """
+        queryset = UserSubscription.objects.expired().filter(active=True)
+        us = queryset.get()
+        us.extend(timedelta(60))
+        Transaction.objects.all().delete()
+        
+        self.assertEqual(ExpireCommand().sweep(queryset, [us.pk], False), 0)
+        self.assertTrue(UserSubscription.objects.get(pk=us.pk).active)
+        self.assertEqual(ExpireCommand().sweep(UserSubscription.objects.expired(), [us.pk], True), 0)
+        self.assertTrue(UserSubscription.objects.filter(pk=us.pk).exists())
+        self.assertFalse(Transaction.objects.exists())
+    
+    def test_archive_transactions(self):
+        for days in (400, 300, 5):
+            t = Transaction.objects.create(user_id=1, subscription_id=2, amount=days,
+                                           event=Transaction.EVENT_PAYMENT)
+            Transaction.objects.filter(id=t.id).update(
+                timestamp=datetime.now() - timedelta(days))
+        expected = list(Transaction.objects.history().values_list('id', 'amount'))
+        # row copied by an interrupted run is not copied again
+        old = Transaction.objects.get(amount=400)
+        ArchivedTransaction.objects.create(**dict((f.attname, getattr(old, f.attname))
+                                                  for f in Transaction._meta.fields))
+        
+        call_command('archive_transactions', days=100, batch_size=1, stdout=StringIO())
+        
+        self.assertEqual(list(Transaction.objects.filter(amount__isnull=False)
+                              .values_list('amount', flat=True)), [5])
+        self.assertEqual(list(ArchivedTransaction.objects.filter(amount__isnull=False)
+                              .values_list('amount', flat=True)), [300, 400])
+        history = Transaction.objects.history()
+        self.assertEqual(list(history.values_list('id', 'amount')), expected)
+        self.assertEqual(history.count(), len(expected))
+        payments = history.filter(amount__isnull=False)
+        self.assertEqual([t.amount for t in payments[1:3]], [300, 400])
+        self.assertEqual([t.amount for t in payments[2:3]], [400])
+        self.assertEqual(history.get(id=old.id).amount, 400)
+
+    def test_migrate_plan(self):
+        silver, gold = Subscription.objects.get(id=1), Subscription.objects.get(id=2)
+        users = [ User.objects.create(username='user%d' % i) for i in range(4) ]
+        silver.bulk_subscribe(users)
+        Transaction.objects.all().delete()
+        first = UserSubscription.objects.get(user=users[0])
+
+        out = StringIO()
+        call_command('migrate_plan', '1', '2', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), '5 subscription(s) would be moved.\n')
+
+        # resumed run skips subscriptions up to --start-after
+        call_command('migrate_plan', '1', '2', batch_size=2, start_after=first.id,
+                     recompute_expires=True, stdout=StringIO())
+        self.assertEqual(list(silver.user_subscriptions.order_by('pk')
+                              .values_list('user', flat=True)),
+                         [2, users[0].id])
+        self.assertEqual(set(gold.user_subscriptions.values_list('expires', flat=True)),
+                         set([date.today() + timedelta(30)]))
+        self.assertEqual(Transaction.objects.filter(event=Transaction.EVENT_SUBSCRIBED,
+                                                    subscription=gold).count(), 3)
+
+        call_command('migrate_plan', '1', '2', stdout=StringIO())
+        self.assertFalse(silver.user_subscriptions.exists())
+        self.assertEqual(Transaction.objects.count(), 5)
@@ -0,0 +1,78 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from subscription import entitlements
+from subscription.middleware import EntitlementMiddleware
+from subscription.models import Subscription
+
+PERMISSIONS = ['auth.add_user', 'subscription.test']
+
+@override_settings(SUBSCRIPTION_ENTITLEMENT_PERMISSIONS=PERMISSIONS)
+class EntitlementsTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        cache.clear()
+        perm = Permission.objects.create(name="test", codename="test",
+                                    content_type=ContentType.objects.get(name="subscription"))
+        Subscription.objects.get(id=2).permissions.add(perm)
+        self.gold_user = User.objects.get(username='gold_user')
+        self.us = self.gold_user.subscription
+    
+    def test_token(self):
+        token = entitlements.issue(self.us)
+        entitlement = entitlements.verify(token)
+        self.assertEqual((entitlement.user_id, entitlement.subscription_id, entitlement.expires),
+                         (self.gold_user.id, 2, self.us.expires))
+        self.assertEqual(entitlement.permissions, frozenset(['subscription.test']))
+        self.assertTrue(entitlement.has_perm('subscription.test'))
+        self.assertFalse(entitlement.has_perm('auth.add_user'))
+        
+        self.assertEqual(entitlements.verify(token.replace('.2.', '.1.', 1)), None)
+        self.assertEqual(entitlements.verify(token, max_age=-1), None)
+        
+        self.us.expires = date.today() - timedelta(30)
+        self.assertFalse(entitlements.verify(entitlements.issue(self.us)).valid())
+    
+    def test_decorator(self):
+        """ tokens are verified without database access """
+        @entitlements.entitlement_required('subscription.test')
+        def view(request):
+            return HttpResponse(str(request.entitlement.user_id))
+        admin_view = entitlements.entitlement_required('auth.add_user')(view)
+        
+        token = entitlements.issue(self.us)
+        request = RequestFactory().get('/', HTTP_X_SUBSCRIPTION_ENTITLEMENT=token)
+        with self.assertNumQueries(0):
+            self.assertEqual(view(request).content, str(self.gold_user.id))
+            self.assertEqual(admin_view(request).status_code, 403)
+            self.assertEqual(view(RequestFactory().get('/')).status_code, 403)
+    
+    def test_middleware(self):
+        """ cookie is reissued only when subscription changes """
+        def respond(user, cookies={}):
+            request = RequestFactory().get('/')
+            request.COOKIES.update(cookies)
+            request.user = user
+            return EntitlementMiddleware().process_response(request, HttpResponse())
+        
+        cookie = respond(self.gold_user).cookies['subscription_entitlement'].value
+        self.assertTrue(entitlements.verify(cookie).valid())
+        user = User.objects.get(id=self.gold_user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(respond(user, {'subscription_entitlement': cookie}).cookies, {})
+        
+        self.us.cancel()
+        user = User.objects.get(id=self.gold_user.id)
+        cookie = respond(user, {'subscription_entitlement': cookie}) \
+            .cookies['subscription_entitlement'].value
+        self.assertFalse(entitlements.verify(cookie).valid())
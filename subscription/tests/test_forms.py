@@ -0,0 +1,41 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from subscription.forms import _paypal_form, _button_cache, paypal_button
+from subscription.models import Subscription
+
+class FormsTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        _button_cache.clear()
+        self.gold_sub = Subscription.objects.get(id=2)
+        self.test_user = User.objects.get(username='test_user')
+        self.silver_user = User.objects.get(username='silver_user')
+    
+    def test_paypal_button(self):
+        """ cached markup differs only by user's custom field """
+        for user in (self.test_user, self.silver_user):
+            self.assertEqual(paypal_button(self.gold_sub, user), 
+                             _paypal_form(self.gold_sub, user).render())
+            self.assertEqual(paypal_button(self.gold_sub, user, upgrade_subscription=True,
+                                           sandbox=True),
+                             _paypal_form(self.gold_sub, user, 
+                                          upgrade_subscription=True).sandbox())
+        self.assertEqual(len(_button_cache), 2)
+        self.assertEqual(_button_cache.hits, 2)
+    
+    def test_versioning(self):
+        paypal_button(self.gold_sub, self.test_user)
+        
+        self.gold_sub.price = 20
+        self.gold_sub.save()
+        self.assertEqual(paypal_button(self.gold_sub, self.test_user),
+                         _paypal_form(self.gold_sub, self.test_user).render())
+        self.assertEqual(len(_button_cache), 1)
+        
+        with override_settings(SUBSCRIPTION_PAYPAL_SETTINGS={'business': 'other@example.com'}):
+            self.assertTrue('other@example.com' in paypal_button(self.gold_sub, self.test_user))
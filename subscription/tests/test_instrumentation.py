@@ -0,0 +1,73 @@
+### -*- coding: utf-8 -*- ####################################################
+
+import socket
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from paypal.standard.ipn.models import PayPalIPN
+
+from subscription import instrumentation, signals
+from subscription.paypalhandlers import handle_payment_was_successful
+
+class InstrumentationTest(TestCase):
+    fixtures = ['test_subscription.json']
+
+    def setUp(self):
+        self.sink = instrumentation.MemorySink()
+        self.previous = instrumentation.set_sink(self.sink)
+        self.gold_user = User.objects.get(username='gold_user')
+        self.ipn = PayPalIPN.objects.create(txn_id='51403485VH153354B',
+                                            custom=str(self.gold_user.id),
+                                            mc_gross='17.00', ipaddress='127.0.0.1')
+
+    def tearDown(self):
+        instrumentation.set_sink(self.previous)
+        connection.use_debug_cursor = None
+
+    def test_payment(self):
+        """ handler, model methods, signals and receivers are measured """
+        connection.use_debug_cursor = True
+        handle_payment_was_successful(self.ipn)
+        stats = self.sink.stats()
+
+        for name in ('paypal.payment_was_successful', 'usersubscription.extend',
+                     'signal.paid', 'signal.recured',
+                     'signal.paid.subscription.transactionhandlers.subscription_paid',
+                     'signal.transactions_recorded'):
+            self.assertEqual(stats[name]['count'], 1, name)
+            self.assertEqual(sum(stats[name]['buckets']), 1)
+        # activate() does nothing for active subscription
+        self.assertFalse('signal.activated' in stats)
+        self.assertTrue(stats['paypal.payment_was_successful']['queries'] >=
+                        stats['signal.transactions_recorded']['queries'] > 0)
+
+    def test_disabled(self):
+        instrumentation.set_sink(None)
+        handle_payment_was_successful(self.ipn)
+        self.assertEqual(self.sink.stats(), {})
+
+    def test_receiver_response(self):
+        """ instrumented send() returns receivers' responses """
+        def reason(sender, **kwargs):
+            return 'no'
+        signals.change_check.connect(reason)
+        try:
+            self.assertEqual(signals.change_check.send(None), [(reason, 'no')])
+        finally:
+            signals.change_check.disconnect(reason)
+        self.assertEqual(self.sink.stats()['signal.change_check']['count'], 1)
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            sink = instrumentation.StatsdSink(port=server.getsockname()[1])
+            sink.record('paypal.payment_was_successful', .0125, 3)
+            self.assertEqual(server.recv(512),
+                             'subscription.paypal.payment_was_successful:12.500|ms\n'
+                             'subscription.paypal.payment_was_successful.queries:3|c')
+        finally:
+            server.close()
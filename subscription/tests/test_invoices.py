@@ -0,0 +1,150 @@
+### -*- coding: utf-8 -*- ####################################################
+
+import csv
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from subscription import invoices
+from subscription.journal import journal
+from subscription.models import Subscription, Transaction
+
+TEMPLATE_DIRS = (os.path.join(os.path.dirname(__file__), 'templates'),)
+
+class InvoicesTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.gold_user = User.objects.get(username='gold_user')
+        self.gold_sub = Subscription.objects.get(id=2)
+        self.payment = Transaction.objects.create(user=self.gold_user, subscription=self.gold_sub,
+                                                  event=Transaction.EVENT_PAYMENT, amount=17)
+    
+    def tearDown(self):
+        invoices.stop_pool()
+        shutil.rmtree(self.cache_dir)
+    
+    def settings(self, workers):
+        return override_settings(TEMPLATE_DIRS=TEMPLATE_DIRS, 
+                                 SUBSCRIPTION_INVOICE_TEMPLATE='subscription/test_invoice.html',
+                                 SUBSCRIPTION_INVOICE_CACHE_DIR=self.cache_dir,
+                                 SUBSCRIPTION_INVOICE_WORKERS=workers)
+    
+    def test_invoice_file(self):
+        """ invoice is rendered once, then served from cache """
+        with self.settings(0):
+            path = invoices.invoice_file(self.payment.id)
+            self.assertTrue(path.startswith(self.cache_dir))
+            self.assertTrue('Gold Membership' in open(path).read())
+            
+            with self.assertNumQueries(0):
+                self.assertEqual(invoices.invoice_file(self.payment.id), path)
+    
+    def test_pregenerate(self):
+        """ payments written by journal are rendered in worker processes """
+        with self.settings(1):
+            invoices.start_pool()
+            with journal.batch():
+                journal.add(Transaction(user=self.gold_user, subscription=self.gold_sub,
+                                        event=Transaction.EVENT_PAYMENT, amount=17))
+            transaction = Transaction.objects.filter(event=Transaction.EVENT_PAYMENT).latest('id')
+            # waits for queued renders
+            invoices.stop_pool()
+            path = invoices.invoice_path(transaction.id)
+            self.assertTrue('Invoice #%d' % transaction.id in open(path).read())
+            
+            invoices.start_pool()
+            result = invoices.pregenerate(self.payment)
+            result.wait(5)
+            self.assertTrue(result.successful())
+            self.assertTrue(os.path.exists(invoices.invoice_path(self.payment.id)))
+            self.assertEqual(invoices.pregenerate(self.payment), None)
+    
+    def test_pregenerate_after_commit(self):
+        """ invoices are rendered once unit of work is over, for rows still there """
+        with self.settings(1):
+            invoices.start_pool()
+            with journal.batch():
+                rows = []
+                for i in range(2):
+                    rows.append(journal.add(Transaction(user=self.gold_user, subscription=self.gold_sub,
+                                                        event=Transaction.EVENT_PAYMENT, amount=17)))
+                    journal.flush()
+                self.assertEqual([ args for func, args in journal.callbacks
+                                   if func == invoices._pregenerate_payments ],
+                                 [ ([row.id], []) for row in rows ])
+                kept, dropped = rows
+                # as if rolled back
+                Transaction.objects.filter(id=dropped.id).delete()
+            invoices.stop_pool()
+            self.assertTrue(os.path.exists(invoices.invoice_path(kept.id)))
+            self.assertFalse(os.path.exists(invoices.invoice_path(dropped.id)))
+    
+    def test_invoice_pending(self):
+        """ download does not wait for worker pool longer than timeout """
+        with self.settings(1):
+            pool = invoices.start_pool()
+            pool.apply_async(time.sleep, (1,))
+            self.assertRaises(invoices.InvoicePending, invoices.invoice_file,
+                              self.payment.id, timeout=0.1)
+            invoices.stop_pool()
+            self.assertTrue(os.path.exists(invoices.invoice_path(self.payment.id)))
+    
+    def test_export_zip(self):
+        """ ZIP archive contains one PDF per payment """
+        Transaction.objects.create(user=self.gold_user, subscription=self.gold_sub,
+                                   event=Transaction.EVENT_PAYMENT, amount=17)
+        Transaction.objects.create(user=self.gold_user, subscription=self.gold_sub,
+                                   event=Transaction.EVENT_ACTIVATED)
+        output = os.path.join(self.cache_dir, 'export.zip')
+        with self.settings(1):
+            invoices.invoice_file(self.payment.id)
+            call_command('export_invoices', output=output)
+        
+        archive = zipfile.ZipFile(output)
+        self.assertEqual(len(archive.namelist()), 2)
+        self.assertTrue('Invoice #%d' % self.payment.id in 
+                        archive.read('invoice-%d.pdf' % self.payment.id))
+    
+    def test_export_csv(self):
+        silver_user = User.objects.get(username='silver_user')
+        Transaction.objects.create(user=silver_user, subscription=self.gold_sub,
+                                   event=Transaction.EVENT_PAYMENT, amount=17)
+        
+        rows = list(csv.reader(StringIO(''.join(invoices.iter_csv(
+                                    invoices.payments(users=[self.gold_user]), chunk_size=1)))))
+        self.assertEqual(rows[0], list(invoices.CSV_FIELDS))
+        self.assertEqual([row[3] for row in rows[1:]], ['gold_user'])
+    
+    def test_history(self):
+        """ history pages follow cursor, one query per page, IPN is not loaded """
+        for i in range(4):
+            Transaction.objects.create(user=self.gold_user, subscription=self.gold_sub,
+                                       event=Transaction.EVENT_PAYMENT, amount=17)
+        expected = list(Transaction.objects.filter(user=self.gold_user, 
+                                                   event=Transaction.EVENT_PAYMENT)
+                        .order_by('-timestamp', '-id').values_list('id', flat=True))
+        
+        seen, cursor = [], None
+        # archive is only queried when recent payments run out
+        for queries in (1, 1, 2):
+            with self.assertNumQueries(queries):
+                page, cursor = invoices.history(self.gold_user, before=cursor, size=2)
+                self.assertEqual([t.subscription.name for t in page], 
+                                 ['Gold Membership'] * len(page))
+            self.assertTrue('_ipn_cache' not in page[0].__dict__)
+            self.assertTrue('comment' not in page[0].__dict__)
+            seen.extend(t.id for t in page)
+        self.assertEqual(cursor, None)
+        self.assertEqual(seen, expected)
+        
+        self.assertRaises(ValueError, invoices.parse_cursor, 'garbage,1')
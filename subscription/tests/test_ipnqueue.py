@@ -0,0 +1,88 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import datetime
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from paypal.standard.ipn.models import PayPalIPN
+from paypal.standard.ipn.signals import payment_was_successful
+
+from subscription import ipnqueue
+from subscription.models import QueuedIPN, Transaction
+
+class IPNQueueTest(TransactionTestCase):
+    # failed handler must really roll back deletion of queued IPN
+    fixtures = ['test_subscription.json']
+
+    def setUp(self):
+        self.gold_user = User.objects.get(username='gold_user')
+        self.silver_user = User.objects.get(username='silver_user')
+
+    def ipn(self, user, txn_id):
+        return PayPalIPN.objects.create(txn_id=txn_id, custom=str(user.id),
+                                        mc_gross='17.00', ipaddress='127.0.0.1')
+
+    def test_queue(self):
+        """ queued IPN is handled by worker """
+        ipn = self.ipn(self.gold_user, '51403485VH153354B')
+        with override_settings(SUBSCRIPTION_IPN_QUEUE=True):
+            payment_was_successful.send(sender=ipn)
+        self.assertEqual(list(QueuedIPN.objects.values_list('handler', 'user_id')),
+                         [('handle_payment_was_successful', self.gold_user.id)])
+        self.assertFalse(Transaction.objects.filter(ipn=ipn).exists())
+
+        out = StringIO()
+        call_command('process_ipn_queue', once=True, stdout=out)
+        self.assertEqual(out.getvalue(), '1 IPN(s) handled.\n')
+        self.assertEqual(Transaction.objects.filter(ipn=ipn,
+                                                    event=Transaction.EVENT_PAYMENT).count(), 1)
+        self.assertFalse(QueuedIPN.objects.exists())
+
+    @override_settings(SUBSCRIPTION_IPN_QUEUE_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        """ failed IPN is retried later, holding back newer IPNs of the same user """
+        failing = ipnqueue.enqueue(self.ipn(self.gold_user, 'A'), 'no_such_handler')
+        held = ipnqueue.enqueue(self.ipn(self.gold_user, 'B'), 'handle_payment_was_successful')
+        other = ipnqueue.enqueue(self.ipn(self.silver_user, 'C'), 'handle_payment_was_successful')
+
+        self.assertEqual(ipnqueue.process(), 2)
+        failing = QueuedIPN.objects.get(id=failing.id)
+        self.assertEqual(failing.attempts, 1)
+        self.assertTrue(failing.next_attempt > datetime.now())
+        self.assertTrue('KeyError' in failing.last_error)
+        self.assertEqual(list(QueuedIPN.objects.values_list('id', flat=True)),
+                         [failing.id, held.id])
+        # nothing due until retry
+        self.assertEqual(ipnqueue.process(), 0)
+
+        QueuedIPN.objects.filter(id=failing.id).update(next_attempt=datetime.now())
+        self.assertEqual(ipnqueue.process(), 1)
+        self.assertTrue(QueuedIPN.objects.get(id=failing.id).dead)
+        # dead IPN does not hold back the rest
+        self.assertEqual(ipnqueue.process(), 1)
+        self.assertEqual(list(QueuedIPN.objects.values_list('id', flat=True)), [failing.id])
+
+        self.assertEqual(ipnqueue.requeue(QueuedIPN.objects.filter(dead=True)), 1)
+        self.assertEqual(list(ipnqueue.due()), [failing])
+
+    def test_overlapping_runs(self):
+        """ IPN claimed by another run is neither handled again nor out of order """
+        for txn_id in ('A', 'B'):
+            ipnqueue.enqueue(self.ipn(self.gold_user, txn_id), 'handle_payment_was_successful')
+        first, second = ipnqueue.due()         # read by an overlapping run
+        self.assertEqual(ipnqueue.handle(second), None)
+
+        self.assertEqual(ipnqueue.process(), 2)
+        self.assertEqual(ipnqueue.handle(first), None)
+        self.assertEqual(Transaction.objects.filter(user=self.gold_user,
+                                                    event=Transaction.EVENT_PAYMENT).count(), 2)
+
+    def test_partitions(self):
+        for user in (self.gold_user, self.silver_user):
+            ipnqueue.enqueue(self.ipn(user, user.username), 'handle_payment_was_successful')
+        for partition in range(2):
+            self.assertEqual([q.user_id % 2 for q in ipnqueue.due(partition, 2)], [partition])
@@ -0,0 +1,82 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from subscription.journal import journal
+from subscription.middleware import TransactionJournalMiddleware
+from subscription.models import DailyRollup, Subscription, Transaction
+
+class JournalTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        self.gold_user = User.objects.get(username='gold_user')
+        self.us = self.gold_user.subscription
+        Transaction.objects.all().delete()
+    
+    def test_batch(self):
+        """ transactions are written in one query at the end of unit of work """
+        with journal.batch():
+            self.us.extend()
+            self.us.cancel()
+            self.us.activate()
+            self.assertEqual(Transaction.objects.count(), 0)
+            self.assertEqual(len(journal.entries), 3)
+        
+        self.assertEqual(sorted(Transaction.objects.values_list('event', flat=True)),
+                         [Transaction.EVENT_ACTIVATED, Transaction.EVENT_CANCELLED,
+                          Transaction.EVENT_RECURED])
+        
+        # one insert for both transactions, one update of existing rollup row
+        DailyRollup.objects.create(date=date.today(), event=Transaction.EVENT_PAYMENT)
+        journal.begin()
+        journal.add(Transaction(user=self.gold_user, event=Transaction.EVENT_PAYMENT))
+        journal.add(Transaction(user=self.gold_user, event=Transaction.EVENT_PAYMENT))
+        self.assertNumQueries(2, journal.end)
+    
+    def test_atomic_rollback(self):
+        """ writes buffered in failed unit of work are dropped """
+        def fail():
+            with journal.atomic():
+                self.us.cancel()
+                raise ValueError
+        
+        with journal.batch():
+            self.us.extend()
+            self.assertRaises(ValueError, fail)
+        
+        self.assertEqual(list(Transaction.objects.values_list('event', flat=True)),
+                         [Transaction.EVENT_RECURED])
+    
+    def test_atomic_nested(self):
+        """ nested atomic unit writes its rows before it commits """
+        with journal.batch():
+            self.us.extend()
+            with journal.atomic():
+                self.us.cancel()
+            self.assertEqual(list(Transaction.objects.values_list('event', flat=True)),
+                             [Transaction.EVENT_CANCELLED])
+            self.assertEqual(len(journal.entries), 1)
+        self.assertEqual(Transaction.objects.count(), 2)
+    
+    def test_middleware_exception(self):
+        """ rows buffered by a failed request are not written """
+        middleware = TransactionJournalMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.us.cancel()
+        middleware.process_exception(request, ValueError())
+        middleware.process_response(request, None)
+        self.assertEqual((journal.depth, journal.entries), (0, []))
+        self.assertEqual(Transaction.objects.count(), 0)
+    
+    @override_settings(SUBSCRIPTION_JOURNAL_IMMEDIATE=True)
+    def test_immediate(self):
+        with journal.batch():
+            self.us.cancel()
+            self.assertEqual(Transaction.objects.count(), 1)
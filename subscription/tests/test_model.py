@@ -102,4 +102,41 @@ class ModelTest(TestCase):
         
         self.gold_user = User.objects.get(username='gold_user')
         self.assertEquals(self.gold_user.get_all_permissions(), set([u'subscription.test']))
-        
\ No newline at end of file
+        
+    def test_subscribe_existing(self):
+        """ subscribe() updates existing subscription with one save """
+        UserSubscription.objects.filter(user=self.gold_user).update(active=False)
+        Transaction.objects.all().delete()
+
+        us = self.gold_sub.subscribe(self.gold_user)
+        self.assertTrue(us.active)
+        self.assertTrue(UserSubscription.objects.get(user=self.gold_user).active)
+        self.assertEqual(list(Transaction.objects.values_list('event', flat=True)),
+                         [Transaction.EVENT_ACTIVATED])
+
+        # nothing to change
+        self.gold_sub.subscribe(self.gold_user)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_bulk_subscribe(self):
+        """ bulk_subscribe() creates, moves and activates subscriptions """
+        UserSubscription.objects.filter(user=self.gold_user).update(active=False)
+        Transaction.objects.all().delete()
+
+        counts = self.gold_sub.bulk_subscribe(
+            [self.test_user, self.silver_user.id, self.gold_user.id, self.test_user.id],
+            batch_size=2)
+        self.assertEqual(counts, (1, 1, 1))
+        self.assertEqual(
+            sorted(UserSubscription.objects.values_list('user', 'subscription', 'active')),
+            [(1, 2, True), (2, 2, True), (3, 2, True)])
+        self.assertEqual(UserSubscription.objects.get(user=self.test_user).expires,
+                         date.today() + timedelta(30))
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('user', 'subscription', 'event')),
+            [(1, 2, Transaction.EVENT_SUBSCRIBED), (2, 2, Transaction.EVENT_SUBSCRIBED),
+             (3, 2, Transaction.EVENT_ACTIVATED)])
+
+        # repeated call changes nothing
+        self.assertEqual(self.gold_sub.bulk_subscribe([1, 2, 3]), (0, 0, 0))
+        self.assertEqual(Transaction.objects.count(), 3)
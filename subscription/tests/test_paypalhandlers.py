@@ -0,0 +1,46 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from paypal.standard.ipn.models import PayPalIPN
+
+from subscription.models import UserSubscription, Transaction
+from subscription.paypalhandlers import handle_payment_was_successful
+
+class PayPalHandlersTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        self.gold_user = User.objects.get(username='gold_user')
+        self.ipn = PayPalIPN.objects.create(txn_id='51403485VH153354B', 
+                                            custom=str(self.gold_user.id),
+                                            mc_gross='17.00', ipaddress='127.0.0.1')
+    
+    def test_payment(self):
+        expires = self.gold_user.subscription.expires
+        handle_payment_was_successful(self.ipn)
+        
+        us = UserSubscription.objects.get(user=self.gold_user)
+        self.assertEqual((us.expires - expires).days, 30)
+        self.assertTrue(us.active)
+        self.assertEqual(Transaction.objects.filter(ipn=self.ipn, 
+                                            event=Transaction.EVENT_PAYMENT).count(), 1)
+    
+    def test_resent_payment(self):
+        """ resent IPN must not extend subscription again """
+        handle_payment_was_successful(self.ipn)
+        expires = UserSubscription.objects.get(user=self.gold_user).expires
+        count = Transaction.objects.count()
+        
+        resent = PayPalIPN.objects.create(txn_id=self.ipn.txn_id, custom=self.ipn.custom,
+                                          mc_gross='17.00', ipaddress='127.0.0.1')
+        handle_payment_was_successful(resent)
+        
+        self.assertEqual(UserSubscription.objects.get(user=self.gold_user).expires, expires)
+        self.assertEqual(Transaction.objects.count(), count)
+    
+    def test_unknown_user(self):
+        self.ipn.custom = '100'
+        handle_payment_was_successful(self.ipn)
+        self.assertFalse(Transaction.objects.filter(ipn=self.ipn).exists())
@@ -0,0 +1,54 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from subscription import signals
+from subscription.catalog import catalog
+from subscription.models import Subscription
+from subscription.policy import policy
+
+class PolicyTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        catalog.invalidate()
+        self.calls = []
+        policy.register(self.no_downgrade)
+        self.us = User.objects.get(username='gold_user').subscription
+        self.silver, self.gold = Subscription.objects.get(id=1), Subscription.objects.get(id=2)
+    
+    def tearDown(self):
+        policy.unregister(self.no_downgrade)
+    
+    def no_downgrade(self, from_plan, to_plan):
+        self.calls.append((from_plan.id, to_plan.id))
+        if to_plan.price < from_plan.price:
+            return u'No downgrades'
+    
+    def test_matrix(self):
+        """ rules are evaluated once per pair of plans """
+        self.assertEqual(self.us.try_change(self.silver), [u'No downgrades'])
+        calls = len(self.calls)
+        self.assertEqual(calls, len(catalog.plans()) * (len(catalog.plans()) - 1))
+        
+        for i in range(3):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.us.try_change(self.silver), [u'No downgrades'])
+        self.assertEqual(len(self.calls), calls)
+        
+        self.silver.price = 100
+        self.silver.save()
+        self.assertEqual(self.us.try_change(self.silver), [])
+    
+    def test_signal(self):
+        """ user dependent checks still come from change_check listeners """
+        def listener(sender, subscription, **kwargs):
+            if sender.user.username == 'gold_user':
+                return u'Not you'
+        signals.change_check.connect(listener)
+        try:
+            self.assertEqual(self.us.try_change(self.silver), [u'No downgrades', u'Not you'])
+        finally:
+            signals.change_check.disconnect(listener)
+        self.assertEqual(self.us.try_change(self.gold), [u'This is your current subscription.'])
@@ -0,0 +1,147 @@
+### -*- coding: utf-8 -*- ####################################################
+
+import httplib
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from subscription import providers
+
+class FakeNVPServer(ThreadingMixIn, HTTPServer):
+    """ keep-alive NVP endpoint on a free local port, recording
+    connections and request bodies; with `drop' set, connection is
+    closed after response without telling the client, with `hangup'
+    set, instead of response; responses are sent after `delay'
+    seconds """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeNVPHandler)
+        self.connections = 0
+        self.bodies = []
+        self.drop = False
+        self.hangup = False
+        self.delay = 0
+        self.url = 'http://127.0.0.1:%d/nvp' % self.server_address[1]
+
+class FakeNVPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.server.bodies.append(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.hangup:
+            self.close_connection = 1
+            return
+        body = 'ACK=Success&TOKEN=EC-%d' % len(self.server.bodies)
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop:
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class Authorize(providers.BasePaymentMethod):
+    def __init__(self, **kwargs):
+        self.name = 'Authorize'
+        self.kwargs = kwargs
+
+class ProvidersTest(TestCase):
+    def setUp(self):
+        self.server = FakeNVPServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_registry(self):
+        """ payment methods are mapped by setting and imported once """
+        self.assertEqual(providers.pick_class('pro'), 'WebsitePaymentsPro')
+        self.assertEqual(providers.pick_class('authorize', 'WebsitePaymentsPro'),
+                         'WebsitePaymentsPro')
+        path = 'subscription.tests.test_providers.Authorize'
+        with override_settings(PAYMENT_METHODS_MAPPINGS={'authorize': path}):
+            self.assertTrue(providers.registry.get('authorize') is Authorize)
+            self.assertRaises(KeyError, providers.registry.get, 'pro')
+            o = providers.PaymentMethodFactory.factory(
+                providers.pick_class('authorize'), data={'amt': 1})
+        self.assertEqual((o.get_name(), o.kwargs), ('Authorize', {'data': {'amt': 1}}))
+        self.assertTrue(providers.registry.resolve('WebsitePaymentsPro')
+                        is providers.WebsitePaymentsPro)
+        self.assertRaises(AttributeError, providers.registry.resolve, 'Nonexistent')
+
+    def test_pool(self):
+        """ calls reuse kept-alive connection """
+        pool = providers.ConnectionPool(self.server.url)
+        for i in range(1, 4):
+            self.assertEqual(pool.post('METHOD=GetBalance'), 'ACK=Success&TOKEN=EC-%d' % i)
+        self.assertEqual((self.server.connections, pool.connections_made), (1, 1))
+        self.assertEqual(self.server.bodies, ['METHOD=GetBalance'] * 3)
+        pool.close()
+
+    def test_pool_reconnect(self):
+        """ connection closed by server is replaced, call is not lost """
+        pool = providers.ConnectionPool(self.server.url)
+        self.server.drop = True
+        pool.post('METHOD=GetBalance')
+        self.server.drop = False
+        # server closes connection just after response
+        time.sleep(0.1)
+        self.assertEqual(pool.post('METHOD=GetBalance'), 'ACK=Success&TOKEN=EC-2')
+        self.assertEqual(pool.post('METHOD=GetBalance'), 'ACK=Success&TOKEN=EC-3')
+        self.assertEqual((self.server.connections, pool.connections_made), (2, 2))
+        pool.close()
+
+    def test_pool_timeout(self):
+        """ call timed out after it was sent is not repeated """
+        pool = providers.ConnectionPool(self.server.url, timeout=0.2)
+        pool.post('METHOD=GetBalance')
+        self.server.delay = 0.5
+        self.assertRaises(socket.timeout, pool.post, 'METHOD=DoDirectPayment')
+        self.assertEqual(self.server.bodies, ['METHOD=GetBalance', 'METHOD=DoDirectPayment'])
+        self.assertEqual(pool.connections_made, 1)
+        pool.close()
+    
+    def test_pool_hangup(self):
+        """ call whose connection was closed without response is not repeated """
+        pool = providers.ConnectionPool(self.server.url)
+        pool.post('METHOD=GetBalance')
+        self.server.hangup = True
+        self.assertRaises(httplib.BadStatusLine, pool.post, 'METHOD=DoDirectPayment')
+        self.assertEqual(self.server.bodies, ['METHOD=GetBalance', 'METHOD=DoDirectPayment'])
+        self.assertEqual(pool.connections_made, 1)
+        pool.close()
+    
+    @override_settings(PAYPAL_WPP_USER='user', PAYPAL_WPP_PASSWORD='password',
+                       PAYPAL_WPP_SIGNATURE='signature')
+    def test_paypal_pro(self):
+        """ Website Payments Pro NVP calls go through process-wide pool """
+        from subscription import paypalpro
+        request = RequestFactory().get('/')
+        with override_settings(SUBSCRIPTION_PAYPAL_NVP_ENDPOINT=self.server.url):
+            for i in range(2):
+                wpp = paypalpro.PooledPayPalWPP(request)
+                wpp._request(wpp.signature + 'METHOD=SetExpressCheckout')
+        self.assertEqual(wpp.endpoint, self.server.url)
+        self.assertEqual(self.server.connections, 1)
+        self.assertTrue(self.server.bodies[1].endswith('&METHOD=SetExpressCheckout'))
+        self.assertTrue(providers.connection_pool(self.server.url)
+                        is providers.connection_pool(self.server.url))
+        providers.connection_pool(self.server.url).close()
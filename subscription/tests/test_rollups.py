@@ -0,0 +1,71 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date, timedelta
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from subscription import rollups
+from subscription.journal import journal
+from subscription.models import DailyRollup, Transaction
+
+class RollupsTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        self.gold_user = User.objects.get(username='gold_user')
+        Transaction.objects.all().delete()
+        DailyRollup.objects.all().delete()
+    
+    def payment(self, amount):
+        return Transaction(user=self.gold_user, subscription_id=2, amount=amount,
+                           event=Transaction.EVENT_PAYMENT)
+    
+    def test_incremental(self):
+        """ journal writes, single and bulk, are added to rollups """
+        journal.add(self.payment(10))
+        with journal.batch():
+            journal.add(self.payment(7))
+            journal.add(self.payment(5))
+            journal.add(Transaction(user=self.gold_user, event=Transaction.EVENT_CANCELLED))
+        
+        self.assertEqual(rollups.totals(), {
+                (2, Transaction.EVENT_PAYMENT): (3, Decimal(22)),
+                (None, Transaction.EVENT_CANCELLED): (1, Decimal(0)),
+                })
+        self.assertEqual(DailyRollup.objects.count(), 2)
+    
+    def test_unique_without_plan(self):
+        """ rollup rows of transactions without plan are unique too """
+        for i in range(2):
+            journal.add(Transaction(user=self.gold_user, event=Transaction.EVENT_CANCELLED))
+        self.assertEqual(list(DailyRollup.objects.values_list('subscription', 'count')),
+                         [(None, 2)])
+        
+        sid = transaction.savepoint()
+        self.assertRaises(IntegrityError, DailyRollup.objects.create, date=date.today(),
+                          event=Transaction.EVENT_CANCELLED)
+        transaction.savepoint_rollback(sid)
+    
+    def test_rebuild(self):
+        """ backfill gives the same rollups as incremental updates """
+        with journal.batch():
+            for amount in (1, 2, 3):
+                journal.add(self.payment(amount))
+        Transaction.objects.filter(amount=1).update(timestamp=date.today() - timedelta(40))
+        Transaction.objects.create(user=self.gold_user, subscription_id=2, amount=4,
+                                   event=Transaction.EVENT_PAYMENT)  # not journaled
+        DailyRollup.objects.all().delete()
+        
+        call_command('rebuild_rollups', chunk_days=7, stdout=StringIO())
+        
+        self.assertEqual(sorted(DailyRollup.objects.values_list('date', 'count', 'amount')), [
+                (date.today() - timedelta(40), 1, Decimal(1)),
+                (date.today(), 3, Decimal(9)),
+                ])
+        self.assertEqual(rollups.totals(start=date.today()),
+                         {(2, Transaction.EVENT_PAYMENT): (3, Decimal(9))})
@@ -0,0 +1,101 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date, timedelta
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from paypal.standard.ipn.models import PayPalIPN
+
+from subscription import scheduler, signals
+from subscription.journal import journal
+from subscription.paypalhandlers import handle_payment_was_successful
+from subscription.models import ScheduledEvent, Subscription, UserSubscription
+
+class SchedulerTest(TestCase):
+    fixtures = ['test_subscription.json']
+
+    def setUp(self):
+        self.test_user = User.objects.get(username='test_user')
+        self.silver_sub = Subscription.objects.get(id=1)
+        self.today = date.today()
+
+    def schedule(self, user):
+        return list(ScheduledEvent.objects.filter(user=user).values_list('kind', 'due'))
+
+    def test_schedule(self):
+        """ schedule follows subscribe, extend, cancel and delete """
+        with journal.batch():
+            us = self.silver_sub.subscribe(self.test_user)
+        # silver plan has 21 day trial period
+        trial_end = self.today + timedelta(21)
+        self.assertEqual(self.schedule(self.test_user), [
+                (ScheduledEvent.KIND_REMINDER, trial_end - timedelta(7)),
+                (ScheduledEvent.KIND_TRIAL_END, trial_end),
+                (ScheduledEvent.KIND_GRACE_END, trial_end + timedelta(2))])
+
+        us.extend(timedelta(10))
+        expires = trial_end + timedelta(10)
+        self.assertEqual(self.schedule(self.test_user), [
+                (ScheduledEvent.KIND_REMINDER, expires - timedelta(7)),
+                (ScheduledEvent.KIND_EXPIRY, expires),
+                (ScheduledEvent.KIND_GRACE_END, expires + timedelta(2))])
+
+        us.cancel()
+        self.assertEqual(self.schedule(self.test_user),
+                         [(ScheduledEvent.KIND_GRACE_END, expires + timedelta(2))])
+
+        us.delete()
+        self.assertEqual(self.schedule(self.test_user), [])
+
+    @override_settings(SUBSCRIPTION_JOURNAL_IMMEDIATE=True)
+    def test_payment_immediate(self):
+        """ schedule follows saved expiry when journal writes right away """
+        gold_user = User.objects.get(username='gold_user')
+        UserSubscription.objects.filter(user=gold_user).update(active=False)
+        ipn = PayPalIPN.objects.create(txn_id='51403485VH153354B', custom=str(gold_user.id),
+                                       mc_gross='17.00', ipaddress='127.0.0.1')
+        handle_payment_was_successful(ipn)
+        
+        expires = UserSubscription.objects.get(user=gold_user).expires
+        self.assertEqual(self.schedule(gold_user), [
+                (ScheduledEvent.KIND_REMINDER, expires - timedelta(7)),
+                (ScheduledEvent.KIND_EXPIRY, expires),
+                (ScheduledEvent.KIND_GRACE_END, expires + timedelta(2))])
+    
+    def test_bulk_subscribe(self):
+        users = [ User.objects.create(username='user%d' % i) for i in range(3) ]
+        self.silver_sub.bulk_subscribe(users)
+        self.assertEqual(ScheduledEvent.objects.filter(user__in=users).count(), 9)
+
+    def test_pop_due(self):
+        """ due events are popped earliest first, once """
+        popped = []
+        def due(sender, **kwargs):
+            popped.append((sender.user.username, sender.kind))
+        signals.event_due.connect(due)
+        try:
+            ScheduledEvent.objects.all().delete()
+            scheduler.rebuild(batch_size=1)
+            day = UserSubscription.objects.get(user__username='gold_user').expires \
+                - timedelta(1)
+
+            out = StringIO()
+            call_command('run_scheduler', date=day.isoformat(), batch_size=2,
+                         stdout=out)
+            self.assertEqual(out.getvalue(), '4 event(s) handled.\n')
+            # silver user: 21 days, gold user: 30 days until expiry
+            self.assertEqual(popped, [
+                    ('silver_user', ScheduledEvent.KIND_REMINDER),
+                    ('silver_user', ScheduledEvent.KIND_EXPIRY),
+                    ('silver_user', ScheduledEvent.KIND_GRACE_END),
+                    ('gold_user', ScheduledEvent.KIND_REMINDER)])
+            self.assertEqual(list(ScheduledEvent.objects.values_list('kind', flat=True)),
+                             [ScheduledEvent.KIND_EXPIRY, ScheduledEvent.KIND_GRACE_END])
+
+            self.assertEqual(scheduler.pop_due(day), [])
+        finally:
+            signals.event_due.disconnect(due)
@@ -0,0 +1,38 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.template import Template, Context
+from django.test import TestCase
+
+from subscription.models import Subscription
+
+class TemplateTagsTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        self.plans = list(Subscription.objects.all())
+        Site.objects.get_current()
+    
+    def render(self, source, username):
+        user = User.objects.get(username=username)
+        return Template('{% load paypal_buttons %}' + source).render(
+                        Context({'user': user, 'plans': self.plans}))
+    
+    def test_paypal_buttons(self):
+        """ batch tag renders the same buttons as paypal_shortcut """
+        for username in ('test_user', 'silver_user'):
+            self.assertEqual(
+                self.render('{% paypal_buttons user plans as buttons %}'
+                            '{% for b in buttons %}{% paypal_button b %}{% endfor %}', username),
+                self.render('{% for p in plans %}{% paypal_shortcut user p %}{% endfor %}', 
+                            username))
+    
+    def test_paypal_buttons_queries(self):
+        """ user's subscription and plan are looked up in one query for all plans """
+        cache.clear()
+        user = User.objects.get(username='silver_user')
+        template = Template('{% load paypal_buttons %}{% paypal_buttons user plans as buttons %}')
+        with self.assertNumQueries(1):
+            template.render(Context({'user': user, 'plans': self.plans * 5}))
@@ -0,0 +1,85 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from subscription.journal import journal
+from subscription import middleware     # request.subscription
+from subscription.models import Subscription, UserSubscription
+from subscription.usercache import user_subscriptions
+
+class UserCacheTest(TestCase):
+    fixtures = ['test_subscription.json']
+    
+    def setUp(self):
+        cache.clear()
+    
+    def get(self, username):
+        return user_subscriptions.get(User.objects.get(username=username))
+    
+    def test_get(self):
+        """ subscription and plan are loaded in one query, then from cache """
+        user = User.objects.get(username='gold_user')
+        with self.assertNumQueries(1):
+            us = user_subscriptions.get(user)
+            self.assertEqual(us.subscription.name, 'Gold Membership')
+            self.assertEqual(us.user, user)
+        # cached object is not used for writes through the relation
+        self.assertFalse(hasattr(user, '_subscription_cache'))
+        
+        user = User.objects.get(username='gold_user')
+        with self.assertNumQueries(0):
+            self.assertEqual(user_subscriptions.get(user).subscription.name, 'Gold Membership')
+            self.assertEqual(user_subscriptions.get(user).user, user)
+        
+        self.assertEqual(self.get('test_user'), None)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_subscriptions.get(AnonymousUser()), None)
+        test_user = User.objects.get(username='test_user')
+        with self.assertNumQueries(0):
+            self.assertEqual(user_subscriptions.get(test_user), None)
+    
+    def test_invalidate(self):
+        """ entries are dropped on subscription signals and plan changes """
+        us = self.get('gold_user')
+        us.cancel()
+        self.assertFalse(self.get('gold_user').active)
+        
+        Subscription.objects.filter(id=2).update(name='Platinum')
+        self.assertEqual(self.get('gold_user').subscription.name, 'Gold Membership')
+        Subscription.objects.get(id=2).save()
+        self.assertEqual(self.get('gold_user').subscription.name, 'Platinum')
+        
+        self.assertEqual(self.get('test_user'), None)
+        UserSubscription.objects.create(user=User.objects.get(username='test_user'),
+                                        subscription_id=2)
+        self.assertEqual(self.get('test_user').subscription_id, 2)
+    
+    def test_invalidate_after_commit(self):
+        """ entry cached by a reader before commit is dropped after it """
+        us = self.get('gold_user')
+        key = user_subscriptions.key(us.user_id)
+        with journal.atomic():
+            us.cancel()
+            self.get('gold_user')
+            self.assertNotEqual(cache.get(key), None)
+        self.assertEqual(cache.get(key), None)
+    
+    def test_invalidate_outside_journal(self):
+        """ outside of journal units entry is dropped right away """
+        us = self.get('gold_user')
+        key = user_subscriptions.key(us.user_id)
+        with transaction.commit_on_success():
+            us.cancel()
+            self.assertEqual(cache.get(key), None)
+        self.assertEqual(journal.callbacks, [])
+    
+    def test_middleware(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='silver_user')
+        with self.assertNumQueries(1):
+            self.assertEqual(request.subscription.subscription.name, 'Silver Membership')
+            self.assertEqual(request.subscription.user, request.user)
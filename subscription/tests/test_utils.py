@@ -0,0 +1,33 @@
+### -*- coding: utf-8 -*- ####################################################
+
+from datetime import date
+
+from django.test import TestCase
+
+from subscription import utils
+
+class UtilsTest(TestCase):
+    
+    dates = [date(2007,1,31), date(2008,2,29), date(2007,12,31), date(2007,10,3)]
+    
+    def test_extend_date_by_month_end(self):
+        """ month and year steps are clamped to month end """
+        self.assertEqual(utils.extend_date_by(date(2007,1,31), 1, 'M'), date(2007,2,28))
+        self.assertEqual(utils.extend_date_by(date(2008,1,31), 1, 'M'), date(2008,2,29))
+        self.assertEqual(utils.extend_date_by(date(2007,8,31), 4, 'M'), date(2007,12,31))
+        self.assertEqual(utils.extend_date_by(date(2008,2,29), 1, 'Y'), date(2009,2,28))
+    
+    def test_extend_dates_by(self):
+        expected = [date(2007,2,28), date(2009,2,28), date(2008,2,29), date(2008,1,10)]
+        self.assertEqual(utils.extend_dates_by(self.dates, [1, 1, 2, 99], ['M', 'Y', 'M', 'D']),
+                         expected)
+        self.assertEqual(utils._extend_dates_by_python(self.dates, [1, 1, 2, 99], 
+                                                       ['M', 'Y', 'M', 'D']), expected)
+        
+        expected = [utils.extend_date_by(d, 5, 'W') for d in self.dates]
+        self.assertEqual(utils.extend_dates_by(self.dates, 5, 'W'), expected)
+        self.assertEqual(utils._extend_dates_by_python(self.dates, 5, 'W'), expected)
+    
+    def test_unknown_unit(self):
+        self.assertRaises(ValueError, utils.extend_dates_by, self.dates, 1, 'Q')
+        self.assertRaises(ValueError, utils._extend_dates_by_python, self.dates, 1, 'Q')
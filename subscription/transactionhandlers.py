@@ -4,46 +4,47 @@
 from django.db.models.signals import post_delete, post_save
 
 from subscription import signals
+from subscription.journal import journal
 from subscription.models import Transaction, UserSubscription
 
 def subscription_deleted(instance, **kwargs):
-    Transaction(user=instance.user, subscription=instance.subscription, 
-                event=Transaction.EVENT_REMOVED).save()
+    journal.add(Transaction(user_id=instance.user_id, subscription_id=instance.subscription_id,
+                            event=Transaction.EVENT_REMOVED))
 post_delete.connect(subscription_deleted, sender=UserSubscription)
 
 def subscription_cancelled(sender, **kwargs): 
-    Transaction(user=sender.user, subscription=sender.subscription,
-                event=Transaction.EVENT_CANCELLED
-                ).save()
+    journal.add(Transaction(user_id=sender.user_id, subscription_id=sender.subscription_id,
+                            event=Transaction.EVENT_CANCELLED
+                            ))
 signals.cancelled.connect(subscription_cancelled)
 
 def subscription_activated(sender, **kwargs):
-    Transaction(user=sender.user, subscription=sender.subscription,
-                event=Transaction.EVENT_ACTIVATED
-                ).save()
+    journal.add(Transaction(user_id=sender.user_id, subscription_id=sender.subscription_id,
+                            event=Transaction.EVENT_ACTIVATED
+                            ))
 signals.activated.connect(subscription_activated)
 
 def subscription_paid(payment, sender, **kwargs):
-    Transaction(user=sender.user, subscription=sender.subscription, ipn=payment,
-                event=Transaction.EVENT_PAYMENT, amount=payment.mc_gross
-                ).save()
+    journal.add(Transaction(user_id=sender.user_id, subscription_id=sender.subscription_id,
+                            ipn=payment, event=Transaction.EVENT_PAYMENT, amount=payment.mc_gross
+                            ))
 signals.paid.connect(subscription_paid)
 
 def subscribedormodified(sender, **kwargs):
-    Transaction(user=sender.user, subscription=sender.subscription,
-                event=Transaction.EVENT_SUBSCRIBED
-                ).save()
+    journal.add(Transaction(user_id=sender.user_id, subscription_id=sender.subscription_id,
+                            event=Transaction.EVENT_SUBSCRIBED
+                            ))
 signals.subscribed.connect(subscribedormodified)
 
 def subscription_created(instance, created, **kwargs):
     if created:
-        Transaction(user=instance.user, subscription=instance.subscription,
-                    event=Transaction.EVENT_SUBSCRIBED
-                    ).save()
+        journal.add(Transaction(user_id=instance.user_id, subscription_id=instance.subscription_id,
+                                event=Transaction.EVENT_SUBSCRIBED
+                                ))
 post_save.connect(subscription_created, sender=UserSubscription)
 
 def subscription_recured(sender, **kwargs):
-    Transaction(user=sender.user, subscription=sender.subscription,
-                event=Transaction.EVENT_RECURED
-                ).save()
+    journal.add(Transaction(user_id=sender.user_id, subscription_id=sender.subscription_id,
+                            event=Transaction.EVENT_RECURED
+                            ))
 signals.recured.connect(subscription_recured)
@@ -1,44 +1,22 @@
 from django.conf.urls.defaults import *
 from django.conf import settings
-from django.views.generic.list_detail import object_list, object_detail
 from django.contrib.auth.decorators import login_required
 from django.views.generic.simple import direct_to_template
 
-from subscription.models import Subscription, Transaction
-from subscription.decorators import pdf_response
+from subscription.catalog import catalog
 
 details_view = 'subscription.views.subscription_pro' if settings.PAYPAL_PRO \
                 else 'subscription.views.subscription_standard_ipn'
 
-invoice_info = {
-    'template_object_name': 'transaction', 
-    'queryset': Transaction.objects.filter(event__exact=Transaction.EVENT_PAYMENT).select_related()
-}
-
-invoice_listing_info = {'template_name': 'subscription/invoice_history.html'}
-invoice_listing_info.update(invoice_info)
-
-invoice_detail_info = {'template_name': 'subscription/invoice.html'}
-invoice_detail_info.update(invoice_info)
-
-invoice_queryset_wrapper = lambda request, queryset: queryset.filter(user=request.user)
-
-
-def wrapped_queryset(func, queryset_edit=lambda request, queryset: queryset):
-    def wrapped(request, queryset, *args, **kwargs):
-        return func(request, queryset_edit(request, queryset), *args, **kwargs)
-    wrapped.__name__ = func.__name__
-    return wrapped
+catalog.warm()
 
 
 urlpatterns = patterns('',
-    url(r'^$', 'django.views.generic.list_detail.object_list', 
-        {'template_name': 'subscription/subscription_list.html',
-         'queryset': Subscription.objects.all()}, name='subscription_list'),
+    url(r'^$', 'subscription.views.subscription_list', 
+        {'template_name': 'subscription/subscription_list.html'}, name='subscription_list'),
 
-    url(r'^plans/', 'django.views.generic.list_detail.object_list', 
-        {'template_name': 'subscription/plans.html',
-         'queryset': Subscription.objects.all()}, name='plans'),
+    url(r'^plans/', 'subscription.views.subscription_list', 
+        {'template_name': 'subscription/plans.html'}, name='plans'),
 
     url(r'^(?P<object_id>\d+)/$', details_view, name='subscription_detail'),
     
@@ -56,12 +34,11 @@ urlpatterns = patterns('',
      {'template': 'subscription/subscription_cancel.html'}, 
      'subscription_cancel'),
      
-    url(r'^invoice/$', 
-        login_required(wrapped_queryset(object_list, invoice_queryset_wrapper)),
-        invoice_listing_info, name='invoice_listing'),
+    url(r'^invoice/$', 'subscription.views.invoice_listing', name='invoice_listing'),
+    
+    url(r'^invoice/(?P<object_id>[\d]+)/$', 'subscription.views.invoice_detail',
+        name='invoice_detail'), 
     
-    url(r'^invoice/(?P<object_id>[\d]+)/$', 
-        pdf_response(login_required(wrapped_queryset(object_detail, invoice_queryset_wrapper))),
-        invoice_detail_info, name='invoice_detail'), 
+    url(r'^invoice/export/$', 'subscription.views.invoice_export', name='invoice_export'), 
     
 )
@@ -0,0 +1,106 @@
+### -*- coding: utf-8 -*- ####################################################
+""" cross-request cache of users' subscriptions """
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from subscription import signals
+from subscription.journal import journal
+from subscription.models import Subscription, UserSubscription
+
+VERSION_KEY = 'subscription-plans-version'
+
+class UserSubscriptionCache(object):
+    """
+        UserSubscription objects, with their Subscription, kept in Django
+        cache for SUBSCRIPTION_USER_CACHE_TIMEOUT seconds (default 3600),
+        including the fact that user has no subscription.
+
+        Entries are dropped when user's subscription is saved, deleted,
+        subscribed, activated, cancelled or recured.  Every entry carries
+        plan version, which is changed on every Subscription save or
+        delete; entry and plan version are read with one get_many().
+
+        Inside a journal unit of work, entries are dropped (and version
+        changed) again once it is over (see journal.after_commit()), as
+        concurrent readers may cache rows not yet committed meanwhile.
+    """
+    def key(self, user_id):
+        return 'subscription-user:%d' % user_id
+
+    def get(self, user):
+        """Return UserSubscription (with its plan) of `user', or None.
+
+        Result is remembered on `user' for the following calls, but not
+        as `user.subscription': cached object may be stale, so it must
+        not be saved."""
+        if not user.is_authenticated():
+            return None
+        try:
+            return user._user_subscription
+        except AttributeError:
+            pass
+
+        key = self.key(user.id)
+        cached = cache.get_many([key, VERSION_KEY])
+        version = cached.get(VERSION_KEY)
+        entry = cached.get(key)
+        if version is not None and entry is not None and entry[0] == version:
+            us = entry[1]
+        else:
+            try:
+                us = UserSubscription.objects.select_related('subscription').get(user=user)
+            except UserSubscription.DoesNotExist:
+                us = None
+            if version is None:
+                version = self._set_version()
+            cache.set(key, (version, us),
+                      getattr(settings, 'SUBSCRIPTION_USER_CACHE_TIMEOUT', 3600))
+
+        user._user_subscription = us
+        if us is not None:
+            us._user_cache = user
+        return us
+
+    def invalidate(self, user_id):
+        self.invalidate_many([user_id])
+
+    def invalidate_many(self, user_ids):
+        keys = [ self.key(user_id) for user_id in user_ids ]
+        cache.delete_many(keys)
+        journal.after_commit(cache.delete_many, keys)
+
+    def plans_version(self):
+        """Return plan version, setting one if there is none."""
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            version = self._set_version()
+        return version
+
+    def plans_changed(self):
+        """Set new plan version, dropping all entries."""
+        self._set_version()
+        journal.after_commit(self._set_version)
+
+    def _set_version(self):
+        version = int(time.time() * 1000)
+        cache.set(VERSION_KEY, version, 30 * 24 * 3600)   # memcached maximum
+        return version
+
+user_subscriptions = UserSubscriptionCache()
+
+
+def _user_subscription_changed(sender=None, instance=None, **kwargs):
+    user_subscriptions.invalidate((instance or sender).user_id)
+for signal in (signals.subscribed, signals.activated, signals.cancelled, signals.recured):
+    signal.connect(_user_subscription_changed)
+post_save.connect(_user_subscription_changed, sender=UserSubscription)
+post_delete.connect(_user_subscription_changed, sender=UserSubscription)
+
+def _subscription_changed(**kwargs):
+    user_subscriptions.plans_changed()
+post_save.connect(_subscription_changed, sender=Subscription)
+post_delete.connect(_subscription_changed, sender=Subscription)
@@ -1,4 +1,13 @@
+import calendar
 import datetime
+import itertools
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def extend_date_by(date, amount, unit):
     """Extend date `date' by `amount' of time units `unit'.
@@ -53,7 +62,102 @@ def extend_date_by(date, amount, unit):
         y += m / 12
         m %= 12
         if not m: m, y = 12, y-1
-        return datetime.date(y, m, d)
+        return datetime.date(y, m, min(d, calendar.monthrange(y, m)[1]))
     elif unit == 'Y':
-        return datetime.date(date.year+amount, date.month, date.day)
+        y, m, d = date.year+amount, date.month, date.day
+        return datetime.date(y, m, min(d, calendar.monthrange(y, m)[1]))
     else: raise "Unknown unit."
+
+_UNITS = ('D', 'W', 'M', 'Y')
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_toordinal = datetime.date.toordinal
+
+def extend_dates_by(dates, amounts, units):
+    """Extend each of `dates' by corresponding `amounts' of time
+    `units', like extend_date_by().
+
+    `amounts' and `units' may be sequences as long as `dates' or
+    single values.  Month and year steps are clamped to the last day
+    of month.  Uses NumPy if it is available.  Returns list of
+    `datetime.date' objects, or `datetime64[D]' array if `dates' is a
+    NumPy `datetime64' array.
+
+    >>> extend_dates_by([datetime.date(2007,1,31), datetime.date(2008,2,29)], 1, ['M', 'Y'])
+    [datetime.date(2007, 2, 28), datetime.date(2009, 2, 28)]
+    """
+    if numpy is None:
+        return _extend_dates_by_python(dates, amounts, units)
+
+    if isinstance(dates, numpy.ndarray):
+        rv = dates.astype('datetime64[D]')
+    else:
+        # going through ordinals is much faster than converting date objects
+        rv = (numpy.fromiter(itertools.imap(_toordinal, dates), numpy.int64)
+              - _EPOCH_ORDINAL).astype('datetime64[D]')
+    amounts = numpy.asarray(amounts, dtype=numpy.int64)
+    units = numpy.asarray(units)
+    if amounts.ndim == 0: amounts = numpy.repeat(amounts, len(rv))
+    if units.ndim == 0: units = numpy.repeat(units, len(rv))
+    if not numpy.in1d(units, _UNITS).all():
+        raise ValueError("Unknown unit.")
+
+    days = numpy.where(units == 'D', amounts, 0) + numpy.where(units == 'W', 7*amounts, 0)
+    months = numpy.where(units == 'M', amounts, 0) + numpy.where(units == 'Y', 12*amounts, 0)
+
+    month = rv.astype('datetime64[M]')
+    day = rv - month.astype('datetime64[D]')
+    month = month + months.astype('timedelta64[M]')
+    start = month.astype('datetime64[D]')
+    last_day = (month + 1).astype('datetime64[D]') - start - 1
+    rv = start + numpy.minimum(day, last_day) + days.astype('timedelta64[D]')
+
+    if isinstance(dates, numpy.ndarray) and dates.dtype.kind == 'M':
+        return rv
+    return rv.tolist()
+
+def _extend_dates_by_python(dates, amounts, units):
+    if isinstance(amounts, (int, long)): amounts = itertools.repeat(amounts)
+    if isinstance(units, basestring): units = itertools.repeat(units)
+    rv = []
+    for date, amount, unit in itertools.izip(dates, amounts, units):
+        if unit not in _UNITS:
+            raise ValueError("Unknown unit.")
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        rv.append(extend_date_by(date, amount, unit))
+    return rv
+
+
+class LRUCache(object):
+    """Mapping that keeps at most `size' most recently used items."""
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -1,18 +1,30 @@
+import os
 import urllib
 
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.sites.models import Site
+from django.core.servers.basehttp import FileWrapper
 from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect
+from django.utils.dateparse import parse_date
 from django.views.generic.simple import direct_to_template
 
-from subscription.models import Subscription
-from subscription.providers import PaymentMethodFactory
+from subscription.models import Subscription, Transaction
+from subscription.catalog import catalog
+from subscription import invoices
+from subscription.providers import PaymentMethodFactory, pick_class
 from subscription.forms import _paypal_form
 
 # https://cms.paypal.com/us/cgi-bin/?cmd=_render-content&content_ID=developer/e_howto_html_Appx_websitestandard_htmlvariables
 
+def subscription_list(request, template_name='subscription/subscription_list.html'):
+    """List all subscriptions from in-process catalog."""
+    return direct_to_template(request, template=template_name,
+                              extra_context={'object_list': catalog.plans()})
+
 @login_required
 def subscription_standard_ipn(request, object_id, queryset=Subscription.objects.filter(price__gt=0), 
                         template_name='subscription/subscription_detail.html'):
@@ -36,6 +48,62 @@ def subscription_pro(request, object_id, queryset=Subscription.objects.filter(pr
             "confirm_template": "subscription/confirmation.html", # template name for confirmation
             "success_url": reverse('subscription_done')}              # redirect location after success
     
-    o = PaymentMethodFactory.factory('WebsitePaymentsPro', data=data, request=request)
+    o = PaymentMethodFactory.factory(pick_class('pro', 'WebsitePaymentsPro'), data=data, request=request)
     # We return o.proceed() just because django-paypal's PayPalPro returns HttpResponse object
     return o.proceed()
+
+@login_required
+def invoice_listing(request, template_name='subscription/invoice_history.html'):
+    """List user payments a page at a time; next page starts after
+    `before' cursor."""
+    try:
+        transactions, next_cursor = invoices.history(request.user,
+                                                     before=request.GET.get('before'))
+    except ValueError:
+        return HttpResponseBadRequest()
+    return direct_to_template(request, template=template_name, extra_context={
+            'object_list': transactions,
+            'transaction_list': transactions,
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None,
+            })
+
+@login_required
+def invoice_detail(request, object_id):
+    """Stream PDF invoice from invoice cache, rendering it if needed."""
+    if not Transaction.objects.history().filter(id=object_id, user=request.user,
+                                                event=Transaction.EVENT_PAYMENT).exists():
+        raise Http404
+    try:
+        path = invoices.invoice_file(int(object_id))
+    except invoices.InvoicePending:
+        response = HttpResponse('Invoice is being prepared, try again shortly.',
+                                status=503, mimetype='text/plain')
+        response['Retry-After'] = 5
+        return response
+    response = HttpResponse(FileWrapper(open(path, 'rb')), mimetype='application/pdf')
+    response['Content-Length'] = os.path.getsize(path)
+    return response
+
+@staff_member_required
+def invoice_export(request):
+    """Stream ZIP archive of PDF invoices, or CSV summary if `format'
+    is `csv', for payments between `start' and `end' dates (YYYY-MM-DD)
+    made by `user' IDs."""
+    try:
+        dates = dict([ (name, parse_date(request.GET[name]))
+                       for name in ('start', 'end') if request.GET.get(name) ])
+        users = [ int(user) for user in request.GET.getlist('user') ]
+    except ValueError:
+        return HttpResponseBadRequest()
+    if None in dates.values():
+        return HttpResponseBadRequest()
+
+    queryset = invoices.payments(users=users, **dates)
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(invoices.iter_csv(queryset), mimetype='text/csv')
+        response['Content-Disposition'] = 'attachment; filename=invoices.csv'
+    else:
+        response = HttpResponse(invoices.iter_zip(queryset), mimetype='application/zip')
+        response['Content-Disposition'] = 'attachment; filename=invoices.zip'
+    return response